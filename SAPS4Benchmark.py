@@ -0,0 +1,257 @@
+trackerPath = 'SAPS4Tracker_v2.0.py' #relative to this file
+proposalCompanyColumn = '$$$$$$$$$$'
+proposalCurrencyColumn = '$$$$$$$$$$'
+proposalErrorColumn = '$$$$$$$$$$'
+proposalForecastAmountColumn = '$$$$$$$$$$'
+proposalAmountColumn = 'Net Amount in FC'
+registerCompanyColumn = '$$$$$$$$$$'
+registerCurrencyColumn = '$$$$$$$$$$'
+registerMethodColumn = '$$$$$$$$$$'
+registerAmountColumn = '$$$$$$$$$$'
+supplementarySheet = '$$$$$$$$$$'
+benchmarkCurrencies = ['USD', 'CAD']
+
+from os import path, mkdir
+from sys import modules
+from time import perf_counter
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+from shutil import rmtree
+from json import dumps as json_dumps
+from datetime import date, timedelta
+from importlib.util import spec_from_file_location, module_from_spec
+from numpy.random import default_rng
+from pandas import DataFrame, ExcelWriter
+
+#the tracker is loaded when this file is imported, so that the ingestion workers (which import this file) can find its functions
+trackerSpec = spec_from_file_location('SAPS4Tracker', path.join(path.dirname(path.abspath(__file__)), trackerPath))
+tracker = module_from_spec(trackerSpec)
+modules['SAPS4Tracker'] = tracker
+trackerSpec.loader.exec_module(tracker)
+
+#Function Definitions
+def BenchmarkRegistry(entities):
+    '''
+    Returns an entity registry of the given number of synthetic companies, spread evenly over the tracker's
+    account structures, with every second company sharing the account of the one before it.
+    '''
+    structures = len(tracker.structureNames)
+    return tracker.CompileEntityRegistry([(str(1000 + 10 * i), benchmarkCurrencies[i % len(benchmarkCurrencies)], str(100000001 + i // 2), i * structures // entities)
+                                          for i in range(entities)], tracker.structureNames, tracker.paymentTypeColumns, tracker.supplementaryStructure)
+
+def WeightedChoice(rng, values, size, probabilities):
+    '''
+    Returns size values drawn from the given values with the given probabilities.
+    '''
+    return [values[index] for index in rng.choice(len(values), size, p = probabilities)]
+
+def WriteProposal(filePath, rows, rng):
+    '''
+    Writes a synthetic SAP S4 payment proposal, where about 2% of the payments carry an error message.
+    '''
+    registry = tracker.CurrentRegistry()
+    pairs = rng.integers(0, len(registry.companies), rows)
+    errors = rng.random(rows) < 0.02
+    data = DataFrame({' Document Number ': rng.integers(10**9, 10**10, rows),
+                      proposalCompanyColumn: [registry.companies[pair] for pair in pairs],
+                      proposalCurrencyColumn: [registry.currencies[pair] for pair in pairs],
+                      ' Vendor ': ['VENDOR ' + str(vendor) for vendor in rng.integers(0, 5000, rows)],
+                      proposalErrorColumn: [('Payment Block Set' if error else None) for error in errors],
+                      proposalAmountColumn: rng.uniform(10, 250000, rows).round(2)})
+    data[proposalForecastAmountColumn] = (data[proposalAmountColumn] * rng.uniform(0.7, 1.4, rows)).round(2)
+    data.to_excel(filePath, index = False)
+
+def WriteRegister(filePath, rows, rng, dataSheet):
+    '''
+    Writes a synthetic payment register of three sheets with its data on the given sheet (2 or 1, counting
+    from 0), and a small share of payments whose payment method is none of EFT/ACH, check or wire.
+    '''
+    registry = tracker.CurrentRegistry()
+    pairs = rng.integers(0, len(registry.companies), rows)
+    methods = WeightedChoice(rng, ['EFT', 'ACH', 'Check', 'Wire', 'Manual'], rows, [0.5, 0.2, 0.2, 0.09, 0.01])
+    data = DataFrame({registerCompanyColumn: [registry.companies[pair] for pair in pairs],
+                      registerCurrencyColumn: [registry.currencies[pair] for pair in pairs],
+                      ' Payment Document ': rng.integers(10**9, 10**10, rows),
+                      registerMethodColumn: methods,
+                      registerAmountColumn: rng.uniform(10, 250000, rows).round(2)})
+    with ExcelWriter(filePath) as writer:
+        for sheet in range(3):
+            if sheet == dataSheet:
+                data.to_excel(writer, sheet_name = 'Register', index = False)
+            else:
+                DataFrame({'Payment Register': ['Synthetic Sheet ' + str(sheet)]}).to_excel(writer, sheet_name = 'Sheet' + str(sheet), index = False)
+
+def WriteTreasura(filePath, rows, rng):
+    '''
+    Writes a synthetic treasura AP EFT report: six rows of title block above the column names (so the
+    header is on row 6, counting from 0), unnamed spacer columns, and rows for every account in the bank,
+    of which only a small share belong to our accounts.
+    '''
+    registry = tracker.CurrentRegistry()
+    ourAccounts = rng.random(rows) < 0.05
+    accounts = [int(registry.accounts[index]) if ours else int(other)
+                for ours, index, other in zip(ourAccounts, rng.integers(0, len(registry.accounts), rows), rng.integers(200000000, 999999999, rows))]
+    subcategories = WeightedChoice(rng, ['AP EFT', 'AP Wires', 'AP Cheques', 'Payroll', 'Interest'], rows, [0.4, 0.2, 0.2, 0.1, 0.1])
+    data = DataFrame({'': [None] * rows,
+                      'ACCOUNT': accounts,
+                      ' ': [None] * rows,
+                      'SUBCATEGORY': subcategories,
+                      'DESCRIPTION': ['Synthetic Transaction'] * rows,
+                      'LEDGER AMOUNT': (-rng.uniform(10, 250000, rows)).round(2)})
+    with ExcelWriter(filePath) as writer:
+        DataFrame([['Treasura AP EFT Report'], ['Synthetic'], [''], [''], [''], ['']]).to_excel(writer, index = False, header = False)
+        data.to_excel(writer, startrow = 6, index = False)
+
+def WriteDepositWorkbook(filePath, historyRows):
+    '''
+    Writes a workbook at depositPath with the supplementary sheet and a 'Database' sheet already holding
+    historyRows rows of history, since the cost of prepending to the sheet grows with its length.
+    '''
+    from openpyxl import Workbook
+    workbook = Workbook()
+    supDataSheet = workbook.active
+    supDataSheet.title = supplementarySheet
+    supDataSheet.append(['Proposed Outflows:  01/01/2000', 0])
+    dataSheet = workbook.create_sheet('Database')
+    dataSheet.append(tracker.databaseColumns)
+    registry = tracker.CurrentRegistry()
+    for i in range(historyRows):
+        dataSheet.append(['Proposal.xlsx', 'Register.xlsx', '01/01/2000', '01/01/2000', registry.companies[i % len(registry.companies)], registry.currencies[i % len(registry.currencies)]]
+                         + [float(i)] * 9 + ['01/01/2000'])
+    workbook.save(filePath)
+
+def GenerateReports(workDir, proposals, registers, rows, treasuraRows, seed):
+    '''
+    Generates the synthetic reports of one day into the proposal, register and treasura directories under
+    workDir, named the way SAP S4 names them, and returns the directories with the lists of filenames.
+    '''
+    rng = default_rng(seed)
+    dateToken = (date.today() - timedelta(1)).strftime("%m%d%y")
+    directories = [path.join(workDir, name) for name in ['Proposals', 'Registers', 'Treasura']]
+    for directory in directories:
+        mkdir(directory)
+    propDir, regDir, treasDir = directories
+    paymentTypes = list(tracker.paymentTypeColumns)
+
+    proposalFiles = []
+    for i in range(proposals):
+        fileName = f"PROPOSAL_{paymentTypes[i % len(paymentTypes)]}_{dateToken}_{i}.xlsx"
+        WriteProposal(path.join(propDir, fileName), rows, rng)
+        proposalFiles.append(fileName)
+    registerFiles = []
+    for i in range(registers):
+        fileName = f"REGISTER_{dateToken}_{i}.xlsx"
+        WriteRegister(path.join(regDir, fileName), rows, rng, 2 if i % 2 == 0 else 1)
+        registerFiles.append(fileName)
+    treasFile = path.join(treasDir, f"AP_EFT_{dateToken}.xlsx")
+    WriteTreasura(treasFile, treasuraRows, rng)
+    return propDir, regDir, proposalFiles, registerFiles, treasFile
+
+def ResetParsing(directories, cold):
+    '''
+    Makes the next pass parse every report from Excel again when cold is set, by emptying the parsed
+    report caches in memory and on disk and restarting the ingestion workers, which keep their own.
+    '''
+    if not cold:
+        return
+    tracker.parsedReports.clear()
+    if tracker.ingestionPool is not None:
+        tracker.ingestionPool.shutdown()
+        tracker.ingestionPool = None
+    for directory in directories:
+        rmtree(tracker.CacheDirectory(directory), ignore_errors = True)
+
+def PeakMemory():
+    '''
+    Returns the peak resident memory, in megabytes, of this process and of its largest finished child
+    process, or None where the resource module is not available.
+    '''
+    try:
+        from resource import getrusage, RUSAGE_SELF, RUSAGE_CHILDREN
+    except ImportError:
+        return None, None
+    return round(getrusage(RUSAGE_SELF).ru_maxrss / 1024, 1), round(getrusage(RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+
+def RunBenchmark(workDir, proposals, registers, rows, treasuraRows, historyRows, repeat, seed, cold, entities = 8):
+    '''
+    Points the tracker at synthetic reports of the given number of entities in workDir and times
+    DataAgreggator_F, DataAgreggator_DB and the database write over them, repeat times. Returns one result
+    per stage, with its timings and the number of files and rows it went through.
+    '''
+    tracker.entityRegistry = BenchmarkRegistry(entities)
+    registry = tracker.entityRegistry
+    tracker.dependenciesDir = workDir + path.sep
+    tracker.depositPath = path.join(workDir, 'Deposit.xlsx')
+    tracker.surveillanceStorePath = path.join(workDir, 'SurveillanceDatabase.sqlite')
+    tracker.runRecordPath = None
+    with open(tracker.dependenciesDir + '$$$$$$$$$$', 'w') as f:
+        f.write('')
+
+    start = perf_counter()
+    propDir, regDir, proposalFiles, registerFiles, treasFile = GenerateReports(workDir, proposals, registers, rows, treasuraRows, seed)
+    WriteDepositWorkbook(tracker.depositPath, historyRows)
+    tracker.OpenSurveillanceStore(seedWorkbook = tracker.depositPath).close() #so the one-off import of the sheet is not timed
+    print(f"Generated {proposals} proposals and {registers} registers of {rows} rows, and a treasura report of {treasuraRows} rows, in {perf_counter() - start:.2f}s")
+
+    propDate = date.today().strftime("%m/%d/%Y")
+    stages = {'DataAgreggator_F': {'files': proposals, 'rows': proposals * rows, 'seconds': []},
+              'DataAgreggator_DB': {'files': proposals + registers + 1, 'rows': (proposals + registers) * rows + treasuraRows, 'seconds': []},
+              'CommitSurveillanceBlocks': {'files': 1, 'rows': entities, 'seconds': []}}
+    for repetition in range(repeat):
+        ResetParsing([propDir, regDir, path.dirname(treasFile)], cold)
+        start = perf_counter()
+        _, _, pooledPropOutflows = tracker.DataAgreggator_F(registry, proposalFiles, propDir, propDate)
+        stages['DataAgreggator_F']['seconds'].append(perf_counter() - start)
+
+        ResetParsing([propDir, regDir, path.dirname(treasFile)], cold)
+        regDate = (date.today() - timedelta(1 + repetition)).strftime("%m/%d/%Y") #a new register date every repetition, so no block is skipped as already written
+        start = perf_counter()
+        finalData = tracker.DataAgreggator_DB(registry, proposalFiles, propDir, propDate, registerFiles, regDir, regDate, treasFile)
+        stages['DataAgreggator_DB']['seconds'].append(perf_counter() - start)
+
+        start = perf_counter()
+        tracker.CommitSurveillanceBlocks([((date.today() - timedelta(repetition)).strftime("%m/%d/%Y"), finalData)], (propDate, pooledPropOutflows[registry.supplementaryStructure]))
+        stages['CommitSurveillanceBlocks']['seconds'].append(perf_counter() - start)
+    if tracker.ingestionPool is not None:
+        tracker.ingestionPool.shutdown()
+        tracker.ingestionPool = None
+
+    results = []
+    for name, stage in stages.items():
+        best = min(stage['seconds'])
+        results.append({'stage': name, 'files': stage['files'], 'rows': stage['rows'], 'best': round(best, 4),
+                        'mean': round(sum(stage['seconds']) / len(stage['seconds']), 4), 'rowsPerSecond': round(stage['rows'] / best) if best > 0 else None})
+    return results
+
+#Program Execution
+if __name__ == '__main__': #the reports are parsed in worker processes, which import this file
+    parser = ArgumentParser(description = "Benchmarks the SAP S4 tracker's aggregation and database write against synthetic reports, offline.")
+    parser.add_argument('--proposals', type = int, default = 10, help = "number of proposal files (default: 10)")
+    parser.add_argument('--registers', type = int, default = 4, help = "number of register files (default: 4)")
+    parser.add_argument('--rows', type = int, default = 5000, help = "rows in each proposal and register (default: 5000)")
+    parser.add_argument('--entities', type = int, default = 8, help = "number of companies tracked (default: 8)")
+    parser.add_argument('--treasura-rows', type = int, default = 50000, help = "rows in the treasura report (default: 50000)")
+    parser.add_argument('--history-rows', type = int, default = 5000, help = "rows already in the 'Database' sheet (default: 5000)")
+    parser.add_argument('--repeat', type = int, default = 3, help = "times each stage is run (default: 3)")
+    parser.add_argument('--workers', type = int, help = "ingestion worker processes, 1 to parse in this process (default: the tracker's setting)")
+    parser.add_argument('--seed', type = int, default = 0, help = "seed of the synthetic data (default: 0)")
+    parser.add_argument('--warm', action = 'store_true', help = "keep the parsed report caches between repetitions instead of parsing from Excel every time")
+    parser.add_argument('--json', action = 'store_true', help = "print the results as one line of JSON, for comparing runs")
+    arguments = parser.parse_args()
+    if arguments.workers is not None:
+        tracker.ingestionWorkers = arguments.workers
+
+    with TemporaryDirectory() as workDir:
+        results = RunBenchmark(workDir, arguments.proposals, arguments.registers, arguments.rows, arguments.treasura_rows,
+                               arguments.history_rows, arguments.repeat, arguments.seed, not arguments.warm, arguments.entities)
+    peakSelf, peakChildren = PeakMemory()
+
+    if arguments.json:
+        print(json_dumps({'arguments': vars(arguments), 'results': results, 'peakMemoryMB': peakSelf, 'peakWorkerMemoryMB': peakChildren}))
+    else:
+        print()
+        print(f"{'Stage':<26}{'Files':>7}{'Rows':>10}{'Best (s)':>11}{'Mean (s)':>11}{'Rows/s':>12}")
+        for result in results:
+            print(f"{result['stage']:<26}{result['files']:>7}{result['rows']:>10}{result['best']:>11.3f}{result['mean']:>11.3f}{result['rowsPerSecond'] or 0:>12}")
+        print()
+        print(f"Peak Memory: {peakSelf} MB (Largest Worker: {peakChildren} MB)")
@@ -4,6 +4,6 @@ call %root%\Anaconda3\Scripts\activate.bat %root%\Anaconda3
 
 cd <directory containing SAPS4Tracker.py>
 
-python "SAPS4Tracker_v2.0.py"
+python "SAPS4Tracker_v2.0.py" --days-prior 0
 
-pause
+exit /b %ERRORLEVEL%
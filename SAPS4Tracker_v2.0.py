@@ -1,51 +1,261 @@
 depositPath = '$$$$$$$$$$'
 dependenciesDir = '$$$$$$$$$$'
-
-from os import chmod, getcwd, path, mkdir, remove, listdir
+ingestionWorkers = None #number of processes used to parse reports. None uses one per CPU, 1 parses them one after another
+parsedReports = {}
+stagedReports = {} #reports being scraped from their local staged copy while they are copied onto the corporate drive
+pipelinedScrapes = {} #scrapes of downloaded reports started during the download, which IngestFiles picks up instead of parsing them again
+ingestionPool = None
+interactive = True #whether someone is at the console. Scheduled runs are not, so nothing waits for input or pauses for reading
+lockPath = dependenciesDir + 'ProgramLock.json' #created exclusively by the run that holds the program lock, and removed when it is released
+lockWaitSeconds = 5 * 60 #how long to wait for another run to release the program lock before giving up
+lockHeartbeatSeconds = 30 #how often the holder of the program lock touches it to show it is still running
+lockStaleSeconds = 10 * 60 #a lock that has not been touched for this long was left behind by a run that crashed, and is taken over
+programLock = None
+exitCodes = {'Success': 0, 'Failure': 1, 'Locked': 2, 'NotReady': 3, 'AlreadyUpdated': 4}
+mainFolderPath = ('$$$$$$$$$$',)
+sapFolderPath = ('$$$$$$$$$$', '$$$$$$$$$$')
+treasFolderPath = ('$$$$$$$$$$', '$$$$$$$$$$')
+proposedOutflowFolderPath = ('$$$$$$$$$$', '$$$$$$$$$$')
+maildirPath = None #when set, mail is read from and written to this maildir instead of the Outlook client
+exchangeDomains = ('$$$$$$$$$$',) #senders in these domains are treated as Exchange ('EX') senders by the maildir backend
+notificationSmtpServer = None #when set to 'host:port', the proposed outflows email is sent through this SMTP server instead of the mail store
+notificationBatchSize = 50 #recipients blind copied on each message of the proposed outflows email
+notificationAttempts = 3 #times sending a message is attempted before its recipients are reported as failed
+surveillanceStorePath = dependenciesDir + 'SurveillanceDatabase.sqlite'
+exportDatabaseSheet = True #whether the 'Database' sheet of the workbook at depositPath is still updated every run
+databaseExportPath = None #when set, the whole surveillance store is exported to this workbook after every update
+runRecordPath = dependenciesDir + 'RunRecords.jsonl' #every run appends a JSON record of how long each stage and report parse took here. None disables it
+runRecord = {'stages': [], 'parses': []}
+watchPollSeconds = 5 * 60 #how often watch mode looks for new proposals
+watchThreshold = 100000.0 #watch mode only sends an updated summary once an account structure's pooled proposed outflows have moved by more than this
+watchUntilHour = 13 #watch mode stops at this hour, eastern time, when the daily run takes over
+breakWindow = 60 #number of previous updates of a company that its variances are compared against
+breakZScore = 3.0 #variances this many standard deviations away from their recent mean are flagged as breaks
+breakMinimumAmount = 1000.0 #variances smaller than this are never flagged, however unusual they are
+databaseColumns = ['ProposalFiles', 'RegisterFile', 'ProposalDate', 'RegisterDate', 'CompanyCode', 'Currency',
+                   'ProposedEFT', 'ProposedWire', 'ProposedCheque', 'RegisterEFT', 'RegisterCheque', 'RegisterWire',
+                   'TreasuraEFT', 'TreasuraWires', 'TreasuraCheques', 'TreasuraDate']
+entityRegistryPath = dependenciesDir + 'EntityRegistry.json' #the companies tracked, see LoadEntityRegistry. The defaults below are used when it does not exist
+entityRegistry = None
+structureNames = ['$$$$$$$$$$', '$$$$$$$$$$', '$$$$$$$$$$']
+defaultEntities = [('$$$$$$$$$$', 'USD', '$$$$$$$$$$', 0), ('$$$$$$$$$$', 'USD', '$$$$$$$$$$', 0),
+                   ('$$$$$$$$$$', 'CAD', '$$$$$$$$$$', 1), ('$$$$$$$$$$', 'CAD', '$$$$$$$$$$', 1), ('$$$$$$$$$$', 'CAD', '$$$$$$$$$$', 1),
+                   ('$$$$$$$$$$', 'USD', '$$$$$$$$$$', 2), ('$$$$$$$$$$', 'USD', '$$$$$$$$$$', 2), ('$$$$$$$$$$', 'USD', '$$$$$$$$$$', 2)] #(company, currency, account, structure)
+supplementaryStructure = structureNames[1] #the name of the account structure whose pooled proposed outflows go into the supplementary data
+paymentComparisons = [('EFT', 'ProposedEFT', 'RegisterEFT', 'TreasuraEFT'),
+                      ('Wire', 'ProposedWire', 'RegisterWire', 'TreasuraWires'),
+                      ('Cheque', 'ProposedCheque', 'RegisterCheque', 'TreasuraCheques')]
+paymentTypeColumns = {'EFT': 6, 'ACH': 6, 'FRTCE': 6, 'FRTUA': 6, 'WIRE': 7, 'SCOCA': 8, 'BMOUS': 8, 'FRTCC': 8, 'FRTUC': 8, 'CBRCC': 8}
+
+from os import chmod, getcwd, path, makedirs, remove, stat, replace, getpid, scandir, utime, rename
+from os import open as os_open, write as os_write, fsync, close as os_close, O_CREAT, O_EXCL, O_WRONLY
 from stat import S_IWUSR, S_IWOTH, S_IRUSR, S_IROTH
-from time import sleep
-from msvcrt import kbhit
+from time import sleep, perf_counter
+from contextlib import contextmanager
 from sys import exit
+from argparse import ArgumentParser
+from atexit import register as atexit_register
 from traceback import print_exc
+from threading import Thread, Event
+from socket import gethostname
+from getpass import getuser
+from uuid import uuid4
+from random import uniform
+from hashlib import blake2b
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait as futures_wait
+from tempfile import TemporaryDirectory
+from shutil import copyfile
+from json import load as json_load, dump as json_dump, dumps as json_dumps
+from sqlite3 import connect as sqlite_connect
+from collections import namedtuple
+from mailbox import Maildir
+from email.message import EmailMessage
+from email.utils import parseaddr, parsedate_to_datetime
+from smtplib import SMTP
 from datetime import date, timedelta, datetime, timezone
 from pytz import timezone as pytzTZ
-from pandas import read_excel, DataFrame, concat, ExcelWriter
-from numpy import empty, empty_like, full, zeros, object, float64, int64, abs, array
+from pandas import read_excel, read_parquet, read_sql_query, DataFrame, Series, Index, concat, ExcelFile, ExcelWriter, MultiIndex, CategoricalDtype, factorize, to_numeric, to_datetime
+from numpy import empty, empty_like, full, zeros, float64, int64, abs, array, bincount, select, nan_to_num, unique
 from numpy import sum as np_sum
-from win32com.client import Dispatch as win32_Dispatch
-from openpyxl import load_workbook
-from openpyxl.styles import Alignment
 
 #Function Definitions
+def Pause(seconds):
+    '''
+    Leaves a message on the console long enough to be read before the window closes. Skipped when the
+    program is not run interactively.
+    '''
+    if interactive:
+        sleep(seconds)
+
+@contextmanager
+def TimedStage(name, **details):
+    '''
+    Times a stage of the run and adds it, with any details given or added to the yielded dictionary, to the run record.
+    '''
+    stage = dict(stage = name, **details)
+    start = perf_counter()
+    try:
+        yield stage
+    except BaseException as e:
+        stage['error'] = type(e).__name__
+        raise
+    finally:
+        stage['seconds'] = round(perf_counter() - start, 4)
+        runRecord['stages'].append(stage)
+
+def SaveRunRecord(record):
+    '''
+    Appends the record of a run as one line of JSON to runRecordPath, so that the history of runs can be
+    compared to spot stages or reports that are getting slower.
+    '''
+    if runRecordPath is None:
+        return
+    try:
+        with open(runRecordPath, 'a') as f:
+            f.write(json_dumps(record, default = str) + '\n')
+    except OSError as e:
+        print(f"The Run Record Could Not Be Saved: {e}")
+
+def ReadLockOwner(filePath):
+    '''
+    Returns the owner recorded in a lock file (its token, user, host, PID and when it was acquired), along
+    with the number of seconds since its heartbeat, or (None, None) if there is no lock file. The owner of
+    a lock file that is still being written, or was left half written, is empty.
+    '''
+    try:
+        age = datetime.now().timestamp() - stat(filePath).st_mtime
+        with open(filePath, 'r') as f:
+            owner = json_load(f)
+    except ValueError:
+        owner = {}
+    except OSError:
+        return None, None
+    return owner, age
+
+def BreakStaleLock(owner):
+    '''
+    Takes over the lock of a run that crashed. The stale lock is first renamed out of the way, which only
+    one of several runs doing this at once can do. If it turns out to have been replaced by a live lock in
+    the meantime, the live lock is put back with an exclusive create, so that it never overwrites a lock
+    another run has acquired since. Should that other run have got there first, the owner of the live lock
+    finds out when it checks the lock before committing.
+    '''
+    stalePath = f"{lockPath}.{uuid4().hex}.stale"
+    try:
+        rename(lockPath, stalePath)
+    except OSError:
+        return
+    moved, _ = ReadLockOwner(stalePath)
+    if moved is not None and moved.get('token') != owner.get('token'):
+        try:
+            descriptor = os_open(lockPath, O_CREAT | O_EXCL | O_WRONLY)
+            try:
+                os_write(descriptor, json_dumps(moved).encode())
+                fsync(descriptor)
+            finally:
+                os_close(descriptor)
+        except OSError:
+            pass
+        try:
+            remove(stalePath)
+        except OSError:
+            pass
+        return
+    if owner:
+        print(f"Took Over The Program Lock Left Behind By {owner.get('user')} On {owner.get('host')} (PID {owner.get('pid')}).")
+    else:
+        print("Took Over A Half Written Program Lock.")
+    try:
+        remove(stalePath)
+    except OSError:
+        pass
+
+def LockHeartbeat(token, stopped):
+    '''
+    Touches the lock file every lockHeartbeatSeconds while the run holding it is alive, so that other runs
+    can tell a long run from a crashed one. Stops if the lock has been taken over.
+    '''
+    while not stopped.wait(lockHeartbeatSeconds):
+        owner, _ = ReadLockOwner(lockPath)
+        if owner is None or owner.get('token') != token:
+            print('The Program Lock Was Taken Over By Another Run.')
+            return
+        try:
+            utime(lockPath)
+        except OSError:
+            pass
+
 def AcquireProgramLock():
     '''
     Acquires the program lock so that another user cannot update the database simultaneously.
+    The lock file is created atomically (it fails if the file already exists), and records who holds it.
+    While another run holds the lock, this run waits for up to lockWaitSeconds, retrying with a jittered
+    exponential backoff, and takes over locks whose heartbeat has gone stale.
     '''
-    chmod(dependenciesDir + '$$$$$$$$$$', S_IWUSR | S_IWOTH) 
-    try:
-        with open(dependenciesDir + '$$$$$$$$$$', 'r+') as f:
-            text = f.read()
-            if text == '$$$$$$$$$$':
-                f.seek(0)
-                f.write('$$$$$$$$$$') 
-                f.truncate()
-            elif text == '$$$$$$$$$$':
+    global programLock
+    owner = {'token': uuid4().hex, 'user': getuser(), 'host': gethostname(), 'pid': getpid(), 'acquired': datetime.now().isoformat(timespec = 'seconds')}
+    deadline = perf_counter() + lockWaitSeconds
+    backoff = 0.5
+    reported = None
+    while True:
+        try:
+            descriptor = os_open(lockPath, O_CREAT | O_EXCL | O_WRONLY)
+        except FileExistsError:
+            holder, age = ReadLockOwner(lockPath)
+            if holder is not None and age > lockStaleSeconds:
+                BreakStaleLock(holder)
+                continue
+            if holder and holder.get('token') != reported:
+                print(f"{holder.get('user')} On {holder.get('host')} Has Been Running This Program Since {holder.get('acquired')}.")
+                reported = holder.get('token')
+            remaining = deadline - perf_counter()
+            if remaining <= 0:
                 print('Another User is Currently Running This Program. Please Try Again Shortly.')
-                sleep(3)
+                Pause(3)
                 print("Program Exiting Safely.")
-                sleep(2)
-                exit()
-    finally:
-        chmod(dependenciesDir + '$$$$$$$$$$', S_IRUSR | S_IROTH) #make file read only
+                Pause(2)
+                exit(exitCodes['Locked'])
+            sleep(min(remaining, uniform(backoff / 2, backoff)))
+            backoff = min(backoff * 2, 30)
+            continue
+        try:
+            os_write(descriptor, json_dumps(owner).encode())
+            fsync(descriptor)
+        finally:
+            os_close(descriptor)
+        break
+
+    stopped = Event()
+    Thread(target = LockHeartbeat, args = (owner['token'], stopped), daemon = True).start()
+    programLock = (owner['token'], stopped)
+
+def CheckProgramLock():
+    '''
+    Exits before anything is committed if the program lock held by this run has been taken over by another
+    run, so that two runs never write the database at once. Does nothing when no lock is held.
+    '''
+    if programLock is None:
+        return
+    owner, _ = ReadLockOwner(lockPath)
+    if owner is None or owner.get('token') != programLock[0]:
+        print('The Program Lock Was Taken Over By Another Run. Nothing Was Committed.')
+        exit(exitCodes['Locked'])
 
 def ReleaseProgramLock():
     '''
-    Releases the program lock when finished so that another user can access the program.
+    Releases the program lock when finished so that another user can access the program. A lock that has
+    been taken over by another run in the meantime is left alone.
     '''
-    chmod(dependenciesDir + '$$$$$$$$$$', S_IWUSR | S_IWOTH) 
-    with open(dependenciesDir + '$$$$$$$$$$', 'w') as f:
-        f.write('$$$$$$$$$$') 
-    chmod(dependenciesDir + '$$$$$$$$$$', S_IRUSR | S_IROTH) 
+    global programLock
+    if programLock is None:
+        return
+    token, stopped = programLock
+    stopped.set()
+    programLock = None
+    owner, _ = ReadLockOwner(lockPath)
+    if owner is not None and owner.get('token') == token:
+        remove(lockPath)
     return
 
 def AcquireDates(numDelta = 0):
@@ -74,27 +284,351 @@ def AcquireDates(numDelta = 0):
 
     return propFocDate, currentDate, priorBusinessDay, propRecvDate_DB
 
-def UpdateInbox():
+MessageSummary = namedtuple('MessageSummary', ['entryId', 'messageClass', 'senderType', 'senderAddress', 'subject', 'receivedTime', 'sentOn'])
+
+class MailStore:
+    '''
+    Interface to the mailbox the program sorts its emails in. Folders are identified by their path under
+    the inbox, e.g. sapFolderPath, with the empty path being the inbox itself.
+    Messages are handed out as MessageSummary snapshots, so that a folder can be scanned in one pass and
+    its messages moved afterwards by EntryID without disturbing the scan.
+    Mail stores that can send several messages at once from different threads set concurrentSends.
+    '''
+    concurrentSends = False
+
+    def Folder(self, folderPath):
+        '''
+        Returns the folder at the given path, creating any missing folders along the way.
+        '''
+        raise NotImplementedError
+
+    def Snapshot(self, folder, limit = None, sentBetween = None):
+        '''
+        Returns summaries of the most recently received messages in a folder, newest first. Only messages
+        sent within the [start, end) interval are returned when 'sentBetween' is given.
+        '''
+        raise NotImplementedError
+
+    def ListFolders(self, folder):
+        '''
+        Returns the names of the folders directly within a folder.
+        '''
+        raise NotImplementedError
+
+    def MoveMessages(self, entryIds, folder):
+        '''
+        Marks the given messages as unread and moves them into the folder.
+        '''
+        raise NotImplementedError
+
+    def Body(self, entryId):
+        '''
+        Returns the plain text body of a message.
+        '''
+        raise NotImplementedError
+
+    def Attachments(self, entryId):
+        '''
+        Returns the filenames of the attachments of a message.
+        '''
+        raise NotImplementedError
+
+    def SaveAttachment(self, entryId, fileName, destination):
+        '''
+        Saves the attachment of a message with the given filename to the destination path.
+        '''
+        raise NotImplementedError
+
+    def Send(self, to, subject, body, bcc = ()):
+        '''
+        Sends a new plain text message to the given lists of recipients. Returns a dictionary of the
+        recipients that were refused, with the reason, if the mail store can tell.
+        '''
+        raise NotImplementedError
+
+def SummaryMatches(message, sentBetween):
+    '''
+    Applies the 'sentBetween' restriction of MailStore.Snapshot to a message summary, for the mail stores
+    that cannot restrict their folders server-side.
+    '''
+    if sentBetween is not None and not (sentBetween[0] <= message.sentOn < sentBetween[1]):
+        return False
+    return True
+
+class OutlookMailStore(MailStore):
+    '''
+    Mail store backed by the Outlook client through COM.
+    Folders are snapshotted through an Outlook Table, which fetches the properties of every message in a
+    single call instead of one COM round-trip per property per message.
+    '''
+    SENDER_SMTP_ADDRESS = 'http://schemas.microsoft.com/mapi/proptag/0x5D01001F'
+
+    def __init__(self):
+        from win32com.client import Dispatch as win32_Dispatch
+        self.application = win32_Dispatch('outlook.application')
+        self.namespace = self.application.GetNamespace('MAPI')
+        self.inbox = self.namespace.GetDefaultFolder(6)
+
+    def Folder(self, folderPath):
+        folder = self.inbox
+        for name in folderPath:
+            if name not in {subFolder.Name for subFolder in folder.Folders}:
+                folder.Folders.Add(name)
+                print(f"Created Folder In '{folder.Name}' Titled: '{name}'")
+            folder = folder.Folders.Item(name)
+        return folder
+
+    def Snapshot(self, folder, limit = None, sentBetween = None):
+        restrictions = []
+        if sentBetween is not None:
+            restrictions.append(f"[SentOn] >= '{sentBetween[0].strftime('%m/%d/%Y %I:%M %p')}'")
+            restrictions.append(f"[SentOn] < '{sentBetween[1].strftime('%m/%d/%Y %I:%M %p')}'")
+        table = folder.GetTable(' AND '.join(restrictions))
+        table.Columns.RemoveAll()
+        for column in ['EntryID', 'MessageClass', 'SenderEmailType', self.SENDER_SMTP_ADDRESS, 'Subject', 'ReceivedTime', 'SentOn']:
+            table.Columns.Add(column)
+        table.Sort('[ReceivedTime]', True)
+        rows = table.GetArray(limit if limit is not None else table.GetRowCount())
+        return [MessageSummary(*row) for row in rows]
+
+    def ListFolders(self, folder):
+        return [subFolder.Name for subFolder in folder.Folders]
+
+    def MoveMessages(self, entryIds, folder):
+        for entryId in entryIds:
+            message = self.namespace.GetItemFromID(entryId)
+            message.UnRead = True
+            message.Move(folder)
+
+    def Body(self, entryId):
+        return self.namespace.GetItemFromID(entryId).Body
+
+    def Attachments(self, entryId):
+        return [attachment.FileName for attachment in self.namespace.GetItemFromID(entryId).Attachments]
+
+    def SaveAttachment(self, entryId, fileName, destination):
+        for attachment in self.namespace.GetItemFromID(entryId).Attachments:
+            if attachment.FileName == fileName:
+                attachment.SaveAsFile(destination)
+                return
+        raise FileNotFoundError(f"{fileName} Is Not Attached To The Message")
+
+    def Send(self, to, subject, body, bcc = ()):
+        newEmail = self.application.CreateItem(0) 
+        newEmail.Subject = subject
+        newEmail.Body = body
+        newEmail.To = '; '.join(to)
+        newEmail.BCC = '; '.join(bcc)
+        newEmail.Send() 
+
+class InMemoryMailStore(MailStore):
+    '''
+    Mail store kept entirely in memory, holding MessageSummary objects. Bodies and attachments are
+    looked up by EntryID in the optional 'bodies' and 'attachments' ({filename: bytes}) dictionaries.
+    Allows the mail handling to be exercised and benchmarked on machines without Outlook.
+    '''
+    def __init__(self, inboxMessages = (), bodies = None, attachments = None):
+        self.folders = {(): list(inboxMessages)}
+        self.bodies = {} if bodies is None else bodies
+        self.attachments = {} if attachments is None else attachments
+        self.unread = set()
+        self.sent = []
+
+    def Folder(self, folderPath):
+        folderPath = tuple(folderPath)
+        for depth in range(1, len(folderPath) + 1):
+            self.folders.setdefault(folderPath[:depth], [])
+        return folderPath
+
+    def Snapshot(self, folder, limit = None, sentBetween = None):
+        messages = [message for message in self.folders[folder] if SummaryMatches(message, sentBetween)]
+        messages.sort(key = lambda message: message.receivedTime, reverse = True)
+        return messages[:limit]
+
+    def ListFolders(self, folder):
+        return [folderPath[-1] for folderPath in self.folders if folderPath[:-1] == folder and len(folderPath) == len(folder) + 1]
+
+    def MoveMessages(self, entryIds, folder):
+        entryIds = set(entryIds)
+        for messages in self.folders.values():
+            moving = [message for message in messages if message.entryId in entryIds]
+            if moving:
+                messages[:] = [message for message in messages if message.entryId not in entryIds]
+                self.folders[folder].extend(moving)
+        self.unread.update(entryIds)
+
+    def Body(self, entryId):
+        return self.bodies.get(entryId, '')
+
+    def Attachments(self, entryId):
+        return list(self.attachments.get(entryId, {}))
+
+    def SaveAttachment(self, entryId, fileName, destination):
+        with open(destination, 'wb') as f:
+            f.write(self.attachments[entryId][fileName])
+
+    def Send(self, to, subject, body, bcc = ()):
+        self.sent.append((list(to), list(bcc), subject, body))
+
+class MaildirMailStore(MailStore):
+    '''
+    Mail store backed by a local maildir, e.g. an export of the shared mailbox. The root of the maildir
+    is treated as the inbox, and sent messages are dropped into its 'Sent' folder as .eml files.
+    Senders whose address is in one of the exchangeDomains are reported as Exchange ('EX') senders,
+    and sent times are converted to local time, as they would be by Outlook. Allows the program to run headless and archived mail to be replayed.
+    '''
+    def __init__(self, rootDir, fromAddress = '$$$$$$$$$$'):
+        self.inbox = Maildir(rootDir, factory = None, create = True)
+        self.folders = {(): self.inbox}
+        self.fromAddress = fromAddress
+
+    def Folder(self, folderPath):
+        folderPath = tuple(folderPath)
+        if folderPath not in self.folders:
+            parent = self.Folder(folderPath[:-1])
+            if folderPath[-1] in parent.list_folders():
+                self.folders[folderPath] = parent.get_folder(folderPath[-1])
+            else:
+                self.folders[folderPath] = parent.add_folder(folderPath[-1])
+                print(f"Created Folder Titled: '{folderPath[-1]}'")
+        return self.folders[folderPath]
+
+    def Summarize(self, key, message):
+        senderAddress = parseaddr(message.get('From', ''))[1].lower()
+        senderType = 'EX' if senderAddress.split('@')[-1] in exchangeDomains else 'SMTP'
+        sentOn = parsedate_to_datetime(message['Date']).astimezone().replace(tzinfo = None) if message['Date'] else datetime.fromtimestamp(message.get_date())
+        return MessageSummary(key, 'IPM.Note', senderType, senderAddress, message.get('Subject', ''), datetime.fromtimestamp(message.get_date()), sentOn)
+
+    def Snapshot(self, folder, limit = None, sentBetween = None):
+        messages = [self.Summarize(key, message) for key, message in folder.iteritems()]
+        messages = [message for message in messages if SummaryMatches(message, sentBetween)]
+        messages.sort(key = lambda message: message.receivedTime, reverse = True)
+        return messages[:limit]
+
+    def ListFolders(self, folder):
+        return folder.list_folders()
+
+    def FindMessage(self, entryId):
+        for folder in self.folders.values():
+            if entryId in folder:
+                return folder, folder[entryId]
+        raise KeyError(entryId)
+
+    def MoveMessages(self, entryIds, folder):
+        for entryId in entryIds:
+            source, message = self.FindMessage(entryId)
+            message.set_subdir('new')
+            message.remove_flag('S')
+            folder.add(message)
+            source.remove(entryId)
+
+    def Body(self, entryId):
+        message = self.FindMessage(entryId)[1]
+        for part in message.walk():
+            if part.get_content_type() == 'text/plain' and part.get_filename() is None:
+                return part.get_payload(decode = True).decode(part.get_content_charset() or 'utf-8', 'replace')
+        return ''
+
+    def Attachments(self, entryId):
+        return [part.get_filename() for part in self.FindMessage(entryId)[1].walk() if part.get_filename()]
+
+    def SaveAttachment(self, entryId, fileName, destination):
+        for part in self.FindMessage(entryId)[1].walk():
+            if part.get_filename() == fileName:
+                with open(destination, 'wb') as f:
+                    f.write(part.get_payload(decode = True))
+                return
+        raise FileNotFoundError(f"{fileName} Is Not Attached To The Message")
+
+    def Send(self, to, subject, body, bcc = ()):
+        newEmail = EmailMessage()
+        newEmail['From'] = self.fromAddress
+        newEmail['To'] = ', '.join(to)
+        if bcc:
+            newEmail['Bcc'] = ', '.join(bcc)
+        newEmail['Subject'] = subject
+        newEmail.set_content(body)
+        self.Folder(('Sent',)).add(newEmail)
+
+class SmtpSender:
+    '''
+    Sends notifications through an SMTP server, e.g. a local debugging server when testing, in place of a
+    mail store's Send. Every message is sent over its own connection, so messages can be sent in parallel.
+    '''
+    concurrentSends = True
+
+    def __init__(self, server, fromAddress = '$$$$$$$$$$'):
+        host, _, port = server.partition(':')
+        self.host = host
+        self.port = int(port) if port else 25
+        self.fromAddress = fromAddress
+
+    def Send(self, to, subject, body, bcc = ()):
+        newEmail = EmailMessage()
+        newEmail['From'] = self.fromAddress
+        if to:
+            newEmail['To'] = ', '.join(to)
+        newEmail['Subject'] = subject
+        newEmail.set_content(body)
+        with SMTP(self.host, self.port, timeout = 60) as server:
+            return server.send_message(newEmail, to_addrs = list(to) + list(bcc))
+
+def DispatchNotification(sender, recipients, subject, body):
+    '''
+    Sends one rendered message to every (name, emailAddress) recipient, blind copied in batches of
+    notificationBatchSize, so the number of messages does not grow with the distribution list. Batches
+    are sent in parallel when the sender supports it. A batch that fails is retried with an exponential
+    backoff, up to notificationAttempts times.
+    Returns the delivery status of every recipient, as (name, emailAddress, status) triples.
+    '''
+    batches = [recipients[start:start + notificationBatchSize] for start in range(0, len(recipients), notificationBatchSize)]
+
+    def SendBatch(batch):
+        for attempt in range(notificationAttempts):
+            try:
+                refused = sender.Send([], subject, body, bcc = [emailAddress for _, emailAddress in batch]) or {}
+                return [(name, emailAddress, f"Refused: {refused[emailAddress]}" if emailAddress in refused else 'Sent') for name, emailAddress in batch]
+            except Exception as e:
+                if attempt == notificationAttempts - 1:
+                    return [(name, emailAddress, f"Failed: {e}") for name, emailAddress in batch]
+                sleep(uniform(1, 2) * 2 ** attempt)
+
+    if sender.concurrentSends and len(batches) > 1:
+        with ThreadPoolExecutor(max_workers = min(len(batches), 8)) as senders:
+            results = list(senders.map(SendBatch, batches))
+    else:
+        results = [SendBatch(batch) for batch in batches]
+    return [status for result in results for status in result]
+
+def OpenMailStore():
+    '''
+    Returns the mail store the program should use: the maildir at maildirPath when it is set, otherwise
+    the Outlook client.
+    '''
+    return MaildirMailStore(maildirPath) if maildirPath else OutlookMailStore()
+
+def UpdateInbox(mailStore = None):
     '''
     Moves emails from inbox into appropriate folders prior to the program running.
     THIS FUNCTION WILL EXECUTE EVERY TIME THE PROGRAM RUNS.
+    The 200 most recent emails are snapshotted in a single pass, and the emails to be moved are then
+    moved by EntryID, so the inbox never has to be re-scanned after a move.
     '''
 
     def AnalyzeSAPS4Email(message):
         analyzeMessage = False
-        if message.Class == 43:
-            if message.SenderEmailType == 'EX':
-                if message.Sender.GetExchangeUser().PrimarySmtpAddress == '$$$$$$$$$$': 
+        if message.messageClass.startswith('IPM.Note'):
+            if message.senderType == 'EX':
+                if message.senderAddress == '$$$$$$$$$$': 
                     analyzeMessage = True
         return analyzeMessage
 
     def AnalyzeTreasuraEmail(message):
         analyzeMessage = False
-        if message.Class == 43:
-            if message.SenderEmailType == 'SMTP':
-                if isinstance(message.Sender.GetExchangeUser(), type(None)):
-                    if '$$$$$$$$$$' in message.subject.lower().replace(' ', ''):
-                        analyzeMessage = True
+        if message.messageClass.startswith('IPM.Note'):
+            if message.senderType == 'SMTP':
+                if '$$$$$$$$$$' in message.subject.lower().replace(' ', ''):
+                    analyzeMessage = True
         return analyzeMessage
 
     def MoveProposedOutflowEmail(message):
@@ -104,83 +638,51 @@ def UpdateInbox():
         functionality to prevent these proposed outflow emails from cluttering up one's inbox.
         '''
         moveMessage = False
-        if message.Class == 43:
-            if message.SenderEmailType == 'EX':
+        if message.messageClass.startswith('IPM.Note'):
+            if message.senderType == 'EX':
                 if '$$$$$$$$$$' in message.subject:
                     moveMessage = True
         return moveMessage
 
-    outlook = win32_Dispatch('outlook.application').GetNamespace('MAPI')
-    inbox = outlook.GetDefaultFolder(6)
+    if mailStore is None:
+        mailStore = OpenMailStore()
 
-    inboxFolders = {folder.Name for folder in inbox.Folders}
-    if '$$$$$$$$$$' in inboxFolders:
-        mainFolder = inbox.Folders.Item('$$$$$$$$$$')
-    else:
-        inbox.Folders.Add('$$$$$$$$$$')
-        mainFolder = inbox.Folders.Item('$$$$$$$$$$')
-        print("Created Folder In Inbox Titled: '$$$$$$$$$$'")
+    inbox = mailStore.Folder(())
+    mailStore.Folder(mainFolderPath)
+    destinations = [(AnalyzeSAPS4Email, mailStore.Folder(sapFolderPath), '$$$$$$$$$$'),
+                    (AnalyzeTreasuraEmail, mailStore.Folder(treasFolderPath), '$$$$$$$$$$'),
+                    (MoveProposedOutflowEmail, mailStore.Folder(proposedOutflowFolderPath), '$$$$$$$$$$')]
 
-    mainFolders = {folder.Name for folder in mainFolder.Folders}
-    if '$$$$$$$$$$' in mainFolders:
-        SAP_Folder = mainFolder.Folders.Item('$$$$$$$$$$')
-    else:
-        mainFolder.Folders.Add('$$$$$$$$$$')
-        SAP_Folder = mainFolder.Folders.Item('$$$$$$$$$$')
-        print("Created Folder In '$$$$$$$$$$' Titled: '$$$$$$$$$$'")
-    if '$$$$$$$$$$' in mainFolders:
-        Treas_Folder = mainFolder.Folders.Item('$$$$$$$$$$')
-    else:
-        mainFolder.Folders.Add('$$$$$$$$$$')
-        Treas_Folder = mainFolder.Folders.Item('$$$$$$$$$$')
-        print("Created Folder In '$$$$$$$$$$' Titled: '$$$$$$$$$$'")
-    if '$$$$$$$$$$' in mainFolders:
-        proposedOutflowFolder = mainFolder.Folders.Item('$$$$$$$$$$')
-    else:
-        mainFolder.Folders.Add('$$$$$$$$$$')
-        proposedOutflowFolder = mainFolder.Folders.Item('$$$$$$$$$$')
-        print("Created Folder In '$$$$$$$$$$' Titled: '$$$$$$$$$$'")
-
-    inbmessages = inbox.Items
-    inbmessages.sort("[ReceivedTime]", True) 
-    inbmessage = inbmessages.GetFirst()
-    nonTargetEmails = 0
-    emailCounter = 0
-
-    while emailCounter < 200: 
-        if not isinstance(inbmessage, type(None)):
-            emailCounter += 1
-            analyzedEmail = False
-
-            if AnalyzeSAPS4Email(inbmessage):
-                inbmessage.Unread = True ; analyzedEmail = True
-                inbmessage.Move(SAP_Folder)
-                print(f"MOVED EMAIL ({inbmessage.subject}) to '$$$$$$$$$$'")
-
-            elif AnalyzeTreasuraEmail(inbmessage):
-                inbmessage.Unread = True ; analyzedEmail = True
-                inbmessage.Move(Treas_Folder)
-                print(f"MOVED EMAIL ({inbmessage.subject}) to '$$$$$$$$$$'")
-
-            elif MoveProposedOutflowEmail(inbmessage):
-                inbmessage.Unread = True ; analyzedEmail = True
-                inbmessage.Move(proposedOutflowFolder)
-                print(f"MOVED EMAIL ({inbmessage.subject}) to '$$$$$$$$$$'")
-
-            if analyzedEmail:
-                inbmessages = inbox.Items 
-                inbmessages.sort("[ReceivedTime]", True)
-                inbmessage = inbmessages.GetFirst()
-                for _ in range(nonTargetEmails):
-                    inbmessage = inbmessages.GetNext()
-            else:
-                nonTargetEmails += 1
-                inbmessage = inbmessages.GetNext()
+    toMove = [[] for _ in destinations]
+    for inbmessage in mailStore.Snapshot(inbox, limit = 200):
+        for index, (Analyze, _, _) in enumerate(destinations):
+            if Analyze(inbmessage):
+                toMove[index].append(inbmessage)
+                break
 
-        else:
-            break
+    for messages, (_, folder, folderName) in zip(toMove, destinations):
+        if messages:
+            mailStore.MoveMessages([message.entryId for message in messages], folder)
+            for message in messages:
+                print(f"MOVED EMAIL ({message.subject}) to '{folderName}'")
 
-def InitializeApplication():
+def CheckUpdateDay(numDelta):
+    '''
+    Exits when the database cannot be updated for the day numDelta days ago without prompting: it is on a
+    weekend, it is the current day and still earlier than 13:00 eastern time, or it has already been updated.
+    '''
+    updateDay = date.today() - timedelta(numDelta)
+    if updateDay.weekday() > 4:
+        print('The Database Cannot Be Updated For A Day Residing On A Weekend.')
+        exit(exitCodes['NotReady'])
+    if numDelta == 0 and datetime.now(timezone.utc).astimezone(pytzTZ('Canada/Eastern')).hour < 13:
+        print('The Database Cannot Be Updated Sooner Than 13:00 Eastern Time For The Current Day.')
+        exit(exitCodes['NotReady'])
+    if updateDay.strftime("%m/%d/%Y") in UpdatedDates():
+        print("The Database Has Already Been Updated For", updateDay.strftime("%m/%d/%Y"))
+        exit(exitCodes['AlreadyUpdated'])
+
+def InitializeApplication(daysPrior = None):
     '''
     Acquires the date from the user. Allows the user to run the program for a previous day in
     case they were away. Prevents the user from updating the database on a day residing on the
@@ -188,7 +690,14 @@ def InitializeApplication():
     database earlier than 13:00 eastern time, to make sure that all of the day's proposals have
     been sent. Also, prevents the database from being updated on the same day twice, by referencing
     the databaseupdatesdates.txt file.
+    When daysPrior is given, as it is for scheduled runs, there is no countdown and that day is checked
+    without prompting, exiting with an exit code that tells the scheduler why the day cannot be updated.
     '''
+    if daysPrior is not None:
+        CheckUpdateDay(daysPrior)
+        return AcquireDates(daysPrior)
+
+    from msvcrt import kbhit
     day = 'unknown'
     while day == 'unknown':
 
@@ -208,26 +717,26 @@ def InitializeApplication():
         if day == 'same':
             if date.today().weekday() > 4:
                 print('The Database Cannot Be Updated For A Day Residing On The Weekend.')
-                sleep(4)
+                Pause(4)
                 print('Returning To Start-Up Menu.')
-                sleep(2)
+                Pause(2)
                 day = 'unknown'
                 continue
             if datetime.now(timezone.utc).astimezone(pytzTZ('Canada/Eastern')).hour < 13:
                 print('The Database Cannot Be Updated Sooner Than 13:00 Eastern Time For The Current Day.')
-                sleep(4)
+                Pause(4)
                 print('Program Exiting Safely.')
-                sleep(2)
-                exit()
+                Pause(2)
+                exit(exitCodes['NotReady'])
             with open(dependenciesDir + '$$$$$$$$$$', 'r') as f:
                 dates = f.read()
                 datesList = dates.split(';')
                 if date.today().strftime("%m/%d/%Y") in datesList:
                     print("The Database Has Already Been Updated For", date.today().strftime("%m/%d/%Y"))
-                    sleep(4)
+                    Pause(4)
                     print('Program Exiting Safely.')
-                    sleep(2)
-                    exit()
+                    Pause(2)
+                    exit(exitCodes['AlreadyUpdated'])
 
             return AcquireDates()
 
@@ -238,14 +747,14 @@ def InitializeApplication():
             except ValueError:
                 print(f"{newday} Is Not An Integer. Returning To Start-Up Menu.")
                 day = 'unknown'
-                sleep(3)
+                Pause(3)
                 continue
 
             if (date.today() - timedelta(newday)).weekday() > 4:
                 print('The Database Cannot Be Updated For A Day Residing On A Weekend.')
-                sleep(4)
+                Pause(4)
                 print('Returning To Start-Up Menu.')
-                sleep(2)
+                Pause(2)
                 day = 'unknown'
                 continue
 
@@ -254,10 +763,10 @@ def InitializeApplication():
                 datesList = dates.split(';')
                 if (date.today() - timedelta(newday)).strftime("%m/%d/%Y") in datesList:
                     print("The Database Has Already Been Updated For", (date.today() - timedelta(newday)).strftime("%m/%d/%Y"))
-                    sleep(4)
+                    Pause(4)
                     print('Program Exiting Safely.')
-                    sleep(2)
-                    exit()
+                    Pause(2)
+                    exit(exitCodes['AlreadyUpdated'])
 
             return AcquireDates(newday) 
 
@@ -266,140 +775,255 @@ def PropRegTreasFolderCleanup(currentDate, propDir, regDir, treasDir):
     Removes files older than 31 days in the directories where the proposals, registers,
     and AP EFT reports are being deposited.
     Prevents hundreds of files accumulating in these directories and taking up large amounts
-    of space on the corporate drive.
+    of space on the corporate drive. The cached versions of the reports are evicted alongside them.
     '''
     if datetime.strptime(currentDate, "%m/%d/%Y").weekday() > 0: 
         return
 
-    def FolderCleaner(directory, fileNames):
-        for file in fileNames:
-            filePath = directory + '/' + file
-            fileDate = datetime.fromtimestamp(path.getmtime(filePath))
-            if (datetime.today() - fileDate).total_seconds() > 60*60*24*31: 
-                remove(filePath) 
+    def FolderCleaner(directory):
+        for entry in CatalogDirectory(directory).entries:
+            if (datetime.today() - entry.modified).total_seconds() > 60*60*24*31: 
+                remove(entry.path) 
+
+    FolderCleaner(propDir)
+    FolderCleaner(regDir)
+    FolderCleaner(treasDir)
 
-    propFileNames = listdir(propDir) 
-    regFileNames = listdir(regDir)
-    treasFileNames = listdir(treasDir)
-    FolderCleaner(propDir, propFileNames)
-    FolderCleaner(regDir, regFileNames)
-    FolderCleaner(treasDir, treasFileNames)
+    for directory in [propDir, regDir, treasDir]:
+        cacheDir = CacheDirectory(directory)
+        if path.isdir(cacheDir):
+            FolderCleaner(cacheDir)
 
-def AcquireFilesFromOutlook(priorBusinessDay, currentDate, regDir, treasDir):
+def LoadHarvestManifest(directory):
+    '''
+    Returns the record of the attachments harvested into a directory: 'messages' maps the EntryID of every
+    message already looked at to the names of its attachments that belong in the directory, and 'owners'
+    maps every file saved to the [EntryID, sent time, size] of the message it was saved from. A record
+    from before owners were kept is discarded, which only costs downloading the day's attachments again.
+    '''
+    manifestPath = path.join(CacheDirectory(directory), 'HarvestedAttachments.json')
+    try:
+        with open(manifestPath, 'r') as f:
+            manifest = json_load(f)
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+    if 'owners' not in manifest:
+        manifest = {'messages': {}, 'owners': {}}
+    return manifest
+
+def SaveHarvestManifest(directory, manifest):
+    '''
+    Writes the record of the attachments saved into a directory, which is kept in the directory's cache.
+    '''
+    cacheDir = CacheDirectory(directory)
+    makedirs(cacheDir, exist_ok = True)
+    tempPath = path.join(cacheDir, 'HarvestedAttachments.json.' + str(getpid()) + '.tmp')
+    with open(tempPath, 'w') as f:
+        json_dump(manifest, f)
+    replace(tempPath, path.join(cacheDir, 'HarvestedAttachments.json'))
+
+def AcquireFilesFromOutlook(priorBusinessDay, currentDate, regDir, treasDir, mailStore = None, proposalsOnly = False):
     '''
     Downloads the appropriate payment registers and treasura AP EFT report from the outlook client onto
-    the corporate drive in the 'regDir' and 'treasDir' directories, respectively.
+    the corporate drive in the 'regDir' and 'treasDir' directories, respectively. With proposalsOnly, only
+    the present day's proposals are downloaded, and the registers and treasura report are left alone.
+    Only the messages sent on the dates of interest are fetched, by restricting the folders on [SentOn].
+    The attachments of messages looked at by an earlier run are known from the harvest manifest, without
+    touching the message. Every file is owned by the message it was last saved from: when an attachment
+    is sent again under the same filename, the file goes to the most recent message in the folders, and a
+    message never overwrites the file of a message sent after it (or at the same time). Files still on the
+    drive with the size their owner saved are not downloaded again. The remaining attachments are saved to
+    a local staging directory and copied onto the corporate drive concurrently.
+    Each report is also handed to the ingestion workers as soon as it is staged, to be scraped from the
+    local copy while the other attachments download, so that parsing overlaps the download and nothing
+    has to be read back from the drive. IngestFiles picks up these scrapes from pipelinedScrapes.
     '''
     def HasDate(string):
         hits = [c.isdigit() for c in string]
         return True if sum(hits) > 4 else False
 
-    outlook = win32_Dispatch('outlook.application').GetNamespace('MAPI')
-    inbox = outlook.GetDefaultFolder(6)
-    SAP_Folder = inbox.Folders.Item('$$$$$$$$$$').Folders.Item('$$$$$$$$$$')
-    SAP_messages = SAP_Folder.Items
-    SAP_messages.sort("[ReceivedTime]", True)
-    Treas_Folder = inbox.Folders.Item('$$$$$$$$$$').Folders.Item('$$$$$$$$$$')
-    Treas_messages = Treas_Folder.Items
-    Treas_messages.sort("[ReceivedTime]", True)
-    proposedOutflowFolder = inbox.Folders.Item('$$$$$$$$$$').Folders.Item('$$$$$$$$$$')
-    proposedOutflow_messages = proposedOutflowFolder.Items
-    proposedOutflow_messages.sort("[ReceivedTime]", True)
-
-    SAP_message = SAP_messages.GetFirst()
-    for _ in range(20):
-        if not isinstance(SAP_message, type(None)):
-            if ('$$$$$$$$$$' in SAP_message.subject.lower()) or ('$$$$$$$$$$' in SAP_message.subject.lower()):
-                pass
-            elif '$$$$$$$$$$' and '$$$$$$$$$$' in SAP_message.subject.lower().replace(' ', ''):
-                if currentDate == SAP_message.SentOn.strftime("%m/%d/%Y"):
-                    for attachment in SAP_message.Attachments:
-                        if '.xls' in attachment.filename and HasDate(attachment.filename):
-                            attachment.SaveAsFile(propDir + '\\' + attachment.filename)
-                            print(f"Downloaded File:  {attachment.filename}")
-            elif '$$$$$$$$$$' in SAP_message.subject.lower().replace(' ', '') and priorBusinessDay == SAP_message.SentOn.strftime("%m/%d/%Y"):
-                for attachment in SAP_message.Attachments:
-                    if '$$$$$$$$$$' and '.xls' in attachment.filename.lower() and HasDate(attachment.filename):
-                        attachment.SaveAsFile(regDir + '\\' + attachment.filename)
-                        print(f"Downloaded File:  {attachment.filename}")
-
-            SAP_message = SAP_messages.GetNext()
-        else:
-            break
-
-    outflowReportAcquired = False
-    Treas_message = Treas_messages.GetFirst()
-    for _ in range(5):
-        if not isinstance(Treas_message, type(None)):
-            if currentDate == Treas_message.SentOn.strftime("%m/%d/%Y"):
-                if '$$$$$$$$$$' in Treas_message.body.lower().replace(' ', ''):
-                    for attachment in Treas_message.Attachments:
-                        if '$$$$$$$$$$' and '.xls' in attachment.filename.lower():
-                            fileName = attachment.filename[:-4] + '_' + priorBusinessDay.replace('/', "") + '.xls'
-                            attachment.SaveAsFile(treasDir + '\\' + fileName)
-                            outflowReportAcquired = True
-                            print(f"Downloaded File:  {fileName}")
-                            print()
-                            break
-
-            if outflowReportAcquired:
-                break
-            else:
-                Treas_message = Treas_messages.GetNext()
-        else:
-            break
-
-def SAPFileDetector(directory, date, reportType):
+    def SelectedAttachments(directory, message, Select):
+        attachmentNames = manifests[directory]['messages'].get(message.entryId)
+        if attachmentNames is None:
+            attachmentNames = [name for name in mailStore.Attachments(message.entryId) if Select(name)]
+            manifests[directory]['messages'][message.entryId] = attachmentNames
+        return attachmentNames
+
+    def Precedence(message, directory, fileName):
+        owner = manifests[directory]['owners'].get(fileName)
+        return message.sentOn.timestamp(), owner is not None and owner[0] == message.entryId #between messages sent at the same time, the owner keeps its file
+
+    def Harvest(message, attachmentName, directory, fileName):
+        destination = path.join(directory, fileName)
+        queued = harvests.get(destination)
+        if queued is None or Precedence(message, directory, fileName) > Precedence(queued[0], directory, fileName):
+            harvests[destination] = (message, attachmentName, directory, fileName)
+
+    def Download(message, attachmentName, directory, fileName):
+        destination = path.join(directory, fileName)
+        owner = manifests[directory]['owners'].get(fileName)
+        if owner is not None and owner[0] != message.entryId and owner[1] >= message.sentOn.timestamp():
+            return #the file belongs to a message sent after this one, or at the same time
+        if owner is not None and owner[0] == message.entryId and path.isfile(destination) and path.getsize(destination) == owner[2]:
+            return
+        stagedPath = path.join(stagingDir, str(len(copies)) + '_' + fileName)
+        mailStore.SaveAttachment(message.entryId, attachmentName, stagedPath)
+        size = path.getsize(stagedPath)
+        copies.append((copier.submit(copyfile, stagedPath, destination), message, directory, fileName, size))
+        if ingestionWorkers != 1:
+            scrape = IngestionPool().submit(StagedScrape, scrapers[directory], destination, stagedPath, registry)
+            pipelinedScrapes[PipelineKey(scrapers[directory], destination, size)] = scrape
+            scrapes.append(scrape)
+
+    if mailStore is None:
+        mailStore = OpenMailStore()
+
+    priorDay = datetime.strptime(priorBusinessDay, "%m/%d/%Y")
+    currentDay = datetime.strptime(currentDate, "%m/%d/%Y")
+    SAP_messages = mailStore.Snapshot(mailStore.Folder(sapFolderPath), sentBetween = (min(priorDay, currentDay), max(priorDay, currentDay) + timedelta(1)))
+    Treas_messages = [] if proposalsOnly else mailStore.Snapshot(mailStore.Folder(treasFolderPath), sentBetween = (currentDay, currentDay + timedelta(1)))
+    manifests = {directory: LoadHarvestManifest(directory) for directory in {propDir, regDir, treasDir}}
+    scrapers = {propDir: ScrapeProposal, regDir: ScrapeRegister, treasDir: ScrapeTreasura}
+    registry = CurrentRegistry()
+
+    harvests = {} #destination -> (message, attachmentName, directory, fileName) of the message the destination goes to
+    copies = []
+    scrapes = []
+    with TemporaryDirectory() as stagingDir:
+        with ThreadPoolExecutor(max_workers = 8) as copier:
+            for SAP_message in SAP_messages:
+                if ('$$$$$$$$$$' in SAP_message.subject.lower()) or ('$$$$$$$$$$' in SAP_message.subject.lower()):
+                    pass
+                elif '$$$$$$$$$$' and '$$$$$$$$$$' in SAP_message.subject.lower().replace(' ', ''):
+                    if currentDate == SAP_message.sentOn.strftime("%m/%d/%Y"):
+                        for fileName in SelectedAttachments(propDir, SAP_message, lambda name: '.xls' in name and HasDate(name)):
+                            Harvest(SAP_message, fileName, propDir, fileName)
+                elif proposalsOnly:
+                    pass
+                elif '$$$$$$$$$$' in SAP_message.subject.lower().replace(' ', '') and priorBusinessDay == SAP_message.sentOn.strftime("%m/%d/%Y"):
+                    for fileName in SelectedAttachments(regDir, SAP_message, lambda name: '$$$$$$$$$$' and '.xls' in name.lower() and HasDate(name)):
+                        Harvest(SAP_message, fileName, regDir, fileName)
+
+            for Treas_message in Treas_messages:
+                if Treas_message.entryId in manifests[treasDir]['messages'] or '$$$$$$$$$$' in mailStore.Body(Treas_message.entryId).lower().replace(' ', ''):
+                    outflowReportAcquired = False
+                    for attachmentName in SelectedAttachments(treasDir, Treas_message, lambda name: '$$$$$$$$$$' and '.xls' in name.lower()):
+                        fileName = attachmentName[:-4] + '_' + priorBusinessDay.replace('/', "") + '.xls'
+                        Harvest(Treas_message, attachmentName, treasDir, fileName)
+                        outflowReportAcquired = True
+                        break
+
+                    if outflowReportAcquired:
+                        break
+
+            for harvest in harvests.values():
+                Download(*harvest)
+
+            for copy, message, directory, fileName, size in copies:
+                try:
+                    copy.result()
+                    sentTime = message.sentOn.timestamp()
+                    utime(path.join(directory, fileName), (sentTime, sentTime)) #the treasura report is found by modification date, which must be the day it was sent, also when it is downloaded later by a backfill
+                    manifests[directory]['owners'][fileName] = [message.entryId, sentTime, size]
+                    print(f"Downloaded File:  {fileName}")
+                except Exception as e:
+                    print(f"ERROR downloading {fileName}")
+                    print(e)
+            futures_wait(scrapes) #the staged copies are removed with the staging directory
+
+    for directory, manifest in manifests.items():
+        SaveHarvestManifest(directory, manifest)
+    print()
+
+CatalogEntry = namedtuple('CatalogEntry', ['name', 'path', 'modified', 'size'])
+FileCatalog = namedtuple('FileCatalog', ['directory', 'entries', 'byDateToken', 'byModifiedDate'])
+
+def DateTokens(fileName):
     '''
-    Searches a given directory (proposal or register) and returns a list with each of the file names to analyze.
+    Returns every mmddyy token a filename could be matched on, i.e. every run of 6 consecutive digits in it.
     '''
-
-    def CheckDate (date, fileToBeChecked):
-        '''
-        Converts a date string mm/dd/yyyy into mmddyy to match what is found in the filenames sent from SAP S4.
-        These filenames on the SAP S4 files can be used to identify what day that file is applicable to.
-        '''
-        toks = date.split('/')
-        dateMod = toks[0] + toks[1] + toks[2][-2:]
-        return True if dateMod in fileToBeChecked else False
-
-    files_needed = []
-    for file in directory:
-        if CheckDate(date, file):
-            files_needed.append(file)
+    tokens = []
+    digits = ''
+    for c in fileName + ' ':
+        if c.isdigit():
+            digits += c
+            continue
+        for start in range(len(digits) - 5):
+            if digits[start:start + 6] not in tokens:
+                tokens.append(digits[start:start + 6])
+        digits = ''
+    return tokens
+
+def CatalogDirectory(directory):
+    '''
+    Lists a proposal, register or treasura directory once, with os.scandir so that the modification time
+    and size of each file come with the listing rather than costing a stat (a network round-trip on the
+    corporate drive) per file. The date tokens of every filename are parsed up front, and
+    the files are indexed by date token and by modification date, so that finding the files for a date
+    is a dictionary lookup.
+    '''
+    entries = []
+    byDateToken = {}
+    byModifiedDate = {}
+    with scandir(directory) as directoryEntries:
+        for directoryEntry in directoryEntries:
+            if not directoryEntry.is_file():
+                continue
+            fileStats = directoryEntry.stat()
+            entry = CatalogEntry(directoryEntry.name, path.join(directory, directoryEntry.name),
+                                 datetime.fromtimestamp(fileStats.st_mtime), fileStats.st_size)
+            entries.append(entry)
+            for token in DateTokens(entry.name):
+                byDateToken.setdefault(token, []).append(entry)
+            byModifiedDate.setdefault(entry.modified.strftime("%m/%d/%Y"), []).append(entry)
+    return FileCatalog(directory, entries, byDateToken, byModifiedDate)
+
+def SAPFileDetector(catalog, date, reportType, onMissing = 'prompt'):
+    '''
+    Searches a given directory's catalog (proposal or register) and returns a list with each of the file names to analyze.
+    Converts the date string mm/dd/yyyy into mmddyy to match what is found in the filenames sent from SAP S4.
+    These filenames on the SAP S4 files can be used to identify what day that file is applicable to.
+    When no files are found, the user is asked whether to continue, unless onMissing is 'continue', 'abort'
+    or 'skip', which raises FileNotFoundError so that the day is left out, as when its treasura report is missing.
+    '''
+    toks = date.split('/')
+    dateMod = toks[0] + toks[1] + toks[2][-2:]
+    files_needed = [entry.name for entry in catalog.byDateToken.get(dateMod, [])]
     if len(files_needed) > 0:
         return files_needed
+    elif onMissing == 'continue':
+        print(f"No {reportType}s Found For {date}.")
+        return files_needed
+    elif onMissing == 'skip':
+        raise FileNotFoundError(f"No {reportType}s Found For {date}")
+    elif onMissing == 'abort':
+        print(f"No {reportType}s Found For {date}.")
+        print('Program Exiting Safely.')
+        exit(exitCodes['NotReady'])
     else: #sometimes there will be no files for analysis. This could be the result of the proposals not being sent yet, or that the next business day is a holiday.
         cont = input(f"No {reportType}s Found For {date}.  Do You Wish To Continue? (y/n): ") #want to continue if no proposals due to holiday
         if cont == 'y':
             return files_needed
         elif cont == 'n': #do not want to continue if the proposals have yet to be sent. Rerun the program manually after the proposals have been sent.
             print('Program Exiting Safely.')
-            sleep(2)
-            exit()
+            Pause(2)
+            exit(exitCodes['NotReady'])
         else:
             print('Incorrect Entry.')
-            sleep(2)
+            Pause(2)
             print('Program Exiting Safely.')
-            sleep(2)
-            exit()
+            Pause(2)
+            exit(exitCodes['NotReady'])
 
-def TreasuraFileDetector(treasDir, treasFilenames, currentDate):
+def TreasuraFileDetector(treasCatalog, currentDate):
     '''
-    Searches the treasura file directory for the filename of the report to analyze.
+    Searches the treasura file directory's catalog for the filename of the report to analyze.
     '''
-    def CheckDate (date, directory, fileName):
-        fileDate = datetime.fromtimestamp(path.getmtime(directory + '\\' + fileName)).strftime("%m/%d/%Y")
-        return True if date == fileDate else False 
-
-    fileNeeded = None
-    for file in treasFilenames:
-        if CheckDate(currentDate, treasDir, file):
-            fileNeeded = file
-    if fileNeeded == None:
+    filesModified = treasCatalog.byModifiedDate.get(currentDate)
+    if not filesModified:
         raise FileNotFoundError('Please Wait for Incoming Data from Treasura') 
     else:
-        return treasDir + '\\' + fileNeeded
+        return filesModified[-1].path
 
 def NameStripper(colnames):
     '''
@@ -409,17 +1033,178 @@ def NameStripper(colnames):
     '''
     return [name.strip() if isinstance(name, str) else 'Unknown' for name in colnames]
 
-def CompanyFilter(dataframe, companyCode, currency, TYPE = 'prop'):
-    """
-    Returns index that fetches rows of the desired company, and the currency of the transactions of that
-    company. This is important, because some of the companies we are looking at have CAD and USD branches,
-    whos transactions are concerned with different Nutrien account structures.
-    """
-    if TYPE == 'prop':
-        index = array(dataframe['$$$$$$$$$$'] == companyCode) & array(dataframe['$$$$$$$$$$'] == currency)
-    elif TYPE == 'reg':
-        index = array(dataframe['$$$$$$$$$$'] == companyCode) & array(dataframe['$$$$$$$$$$'] == currency)
-    return index
+def ReportKey(filePath):
+    '''
+    Identifies a report on disk by its normalized path, modification time and size, so that the same
+    workbook is recognized no matter how its path was joined, and a workbook that has been overwritten
+    is not mistaken for the one that was parsed earlier.
+    '''
+    normalizedPath = path.normcase(path.abspath(filePath))
+    fileStats = stat(normalizedPath)
+    return normalizedPath, fileStats.st_mtime_ns, fileStats.st_size
+
+def CacheDirectory(directory):
+    '''
+    Returns the directory, sitting next to the given proposal, register or treasura directory, in which
+    the parsed versions of its reports are cached.
+    '''
+    return path.normpath(directory) + '_ParsedCache'
+
+def CachedReportPath(filePath, content, readOptions):
+    '''
+    Returns the path of the cached version of a report. Cached reports are addressed by the hash of the
+    workbook's contents and the options used to parse it, so a report that is downloaded again under the
+    same name but with new contents is never served stale.
+    '''
+    hasher = blake2b(content, digest_size = 20)
+    hasher.update(repr(sorted(readOptions.items())).encode())
+    return path.join(CacheDirectory(path.dirname(filePath)), hasher.hexdigest() + '.parquet')
+
+def StoreCachedReport(cachePath, data):
+    '''
+    Writes a parsed report to the cache. The file is written under a temporary name first and then
+    renamed, so that a concurrent run never reads a partially written cache file.
+    Not every report can be stored in a columnar format (e.g. columns holding both text and numbers),
+    in which case the report is simply parsed from Excel again next time.
+    '''
+    tempPath = cachePath + '.' + str(getpid()) + '.tmp'
+    try:
+        makedirs(path.dirname(cachePath), exist_ok = True) #several ingestion workers may create it at once
+        data.to_parquet(tempPath)
+        replace(tempPath, cachePath)
+    except Exception as e:
+        print(f"Unable to cache {path.basename(cachePath)}: {e}")
+        if path.exists(tempPath):
+            remove(tempPath)
+
+def ReadReport(filePath, reader = read_excel, **readOptions):
+    '''
+    Parses a SAP S4 report with read_excel (or the given reader, which is handed a file-like object and
+    the read options) and strips its column names with NameStripper.
+    Each workbook is only parsed once per run: the parsed frame is kept in parsedReports so that the
+    forecast and database passes can share it when their dates overlap. The returned frame is shared,
+    so callers must not modify it in place.
+    Across runs, parsed reports are kept in a columnar cache next to the report's directory, which is
+    checked before falling back to Excel. Every read is added to the parses of the run record.
+    Reports registered in stagedReports are read from their local staged copy, but cached under their
+    path on the drive. A workbook that has been overwritten drops the frames parsed from its earlier
+    contents, so that a long running watch does not keep frames that can never be served again.
+    '''
+    start = perf_counter()
+    sourcePath = stagedReports.get(path.normcase(path.abspath(filePath)), filePath) #a report still being copied onto the drive is read from its staged copy
+    cacheOptions = readOptions if reader is read_excel else dict(readOptions, reader = reader.__name__)
+    key = ReportKey(sourcePath) + (tuple(sorted(cacheOptions.items())),)
+    source = 'memory'
+    if key not in parsedReports:
+        for staleKey in [cached for cached in parsedReports if cached[0] == key[0] and cached[1:3] != key[1:3]]:
+            del parsedReports[staleKey]
+        with open(sourcePath, 'rb') as f:
+            content = f.read()
+        cachePath = CachedReportPath(filePath, content, cacheOptions)
+        try:
+            data = read_parquet(cachePath) if path.exists(cachePath) else None
+        except Exception:
+            data = None
+        source = 'cache'
+        if data is None:
+            data = reader(BytesIO(content), **readOptions) #the BytesIO shares the bytes read, rather than copying them
+            data.columns = NameStripper(data.columns)
+            StoreCachedReport(cachePath, data)
+            source = reader.__name__
+        parsedReports[key] = data
+    runRecord['parses'].append({'file': path.basename(filePath), 'source': source, 'bytes': key[2], 'rows': len(parsedReports[key]),
+                                'seconds': round(perf_counter() - start, 4), 'process': getpid()})
+    return parsedReports[key]
+
+def ReadSAPReport(source, sheets, columns):
+    '''
+    Reads only the given columns of a SAP S4 proposal or register, from the first of the given sheets
+    (counting from 0) whose header has all of them. 'columns' pairs each column name, as stripped by
+    NameStripper, with the dtype it is read as: 'category' for the codes, currencies, payment methods and
+    error messages, which repeat throughout a report, and 'float64' for the amounts.
+    The workbook is opened once and each candidate sheet is probed by reading its header row alone, so
+    sheets without the data are never loaded and the other columns are never converted. Amounts are
+    converted to floats after reading, so that a stray text cell does not fail the whole report.
+    '''
+    dtypes = dict(columns)
+    with ExcelFile(source) as workbook:
+        for sheet in sheets:
+            if sheet >= len(workbook.sheet_names):
+                continue
+            rawNames = workbook.parse(sheet_name = sheet, nrows = 0).columns
+            names = dict(zip(NameStripper(rawNames), rawNames))
+            missing = [column for column in dtypes if column not in names]
+            if not missing:
+                break
+        else:
+            raise ValueError(f"{', '.join(repr(column) for column in missing)} Column Not Found In Sheets {', '.join(str(sheet) for sheet in sheets)}")
+        wanted = {names[column] for column in dtypes}
+        data = workbook.parse(sheet_name = sheet, usecols = lambda name: name in wanted,
+                              dtype = {names[column]: dtype for column, dtype in dtypes.items() if dtype != 'float64'})
+    data.columns = NameStripper(data.columns)
+    for column, dtype in dtypes.items():
+        if dtype == 'float64':
+            data[column] = to_numeric(data[column], errors = 'coerce').astype(float64)
+    return data[list(dtypes)]
+
+def StreamTreasuraReport(source, header, accounts):
+    '''
+    Reads only the ACCOUNT, SUBCATEGORY and LEDGER AMOUNT columns of a treasura AP EFT report, whose column
+    names are on row 'header' (counting from 0), keeping only the rows of the given accounts as it goes.
+    The report covers every account in the bank, so it is never loaded into a full frame: .xlsx reports
+    are streamed row by row with openpyxl in read-only mode. The .xls (BIFF) format cannot be streamed, so
+    xlrd decodes the whole sheet of an .xls report, but only the three columns that are needed are copied
+    out of it, and the sheet is released as soon as they are. The bytes of an .xls report are handed to xlrd
+    without being copied.
+    '''
+    def AccountNumber(value):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return None
+
+    wanted = ['ACCOUNT', 'SUBCATEGORY', 'LEDGER AMOUNT']
+    accounts = {int(account) for account in accounts}
+    rows = {column: [] for column in wanted}
+
+    def Keep(account, subcategory, amount):
+        account = AccountNumber(account)
+        if account in accounts and amount is not None and amount != '':
+            rows['ACCOUNT'].append(account)
+            rows['SUBCATEGORY'].append(subcategory)
+            rows['LEDGER AMOUNT'].append(amount)
+
+    if source.read(2) == b'PK': #.xlsx reports are zip archives
+        source.seek(0)
+        from openpyxl import load_workbook
+        workbook = load_workbook(source, read_only = True, data_only = True)
+        try:
+            sheetRows = workbook.worksheets[0].iter_rows(min_row = header + 1, values_only = True)
+            names = NameStripper(next(sheetRows))
+            indices = [names.index(column) for column in wanted]
+            for row in sheetRows:
+                if len(row) > max(indices):
+                    Keep(*[row[index] for index in indices])
+        finally:
+            workbook.close()
+    else:
+        from xlrd import open_workbook as xlrd_open_workbook
+        source.seek(0)
+        workbook = xlrd_open_workbook(file_contents = source.getvalue() if hasattr(source, 'getvalue') else source.read(), on_demand = True)
+        try:
+            sheet = workbook.sheet_by_index(0)
+            names = NameStripper(sheet.row_values(header))
+            columns = [sheet.col_values(names.index(column), start_rowx = header + 1) for column in wanted]
+            del sheet
+            workbook.unload_sheet(0)
+            for account, subcategory, amount in zip(*columns):
+                Keep(account, subcategory, amount)
+        finally:
+            workbook.release_resources()
+
+    data = DataFrame(rows, columns = wanted)
+    data['LEDGER AMOUNT'] = to_numeric(data['LEDGER AMOUNT'], errors = 'coerce')
+    return data
 
 def PaymentErrorFilter(dataframe):
     """
@@ -430,6 +1215,299 @@ def PaymentErrorFilter(dataframe):
     """
     return dataframe['$$$$$$$$$$'].isna()
 
+def ClassifyPaymentMethods(methods):
+    '''
+    Classifies the payment method of every payment in a register at once. The methods are lowercased a
+    single time with vectorized string operations, and each payment is given a code: 0 for EFT/ACH,
+    1 for check, 2 for wire and -1 if the method is none of these.
+    Categorical methods are classified once per category rather than once per payment.
+    '''
+    if isinstance(methods.dtype, CategoricalDtype):
+        categoryCodes = ClassifyPaymentMethods(Series(methods.cat.categories.astype(str))).to_numpy()
+        codes = methods.cat.codes.to_numpy()
+        return Series(select([codes >= 0], [categoryCodes[codes]], default = -1), index = methods.index)
+    lowered = methods.astype(str).str.lower()
+    eftach = lowered.str.contains('eft', regex = False) | lowered.str.contains('ach', regex = False)
+    check = lowered.str.contains('check', regex = False)
+    wire = lowered.str.contains('wire', regex = False)
+    return Series(select([eftach, check, wire], [0, 1, 2], default = -1), index = methods.index)
+
+EntityRegistry = namedtuple('EntityRegistry', ['companies', 'currencies', 'accounts', 'structures', 'structureNames', 'pairs',
+                                               'accountNumbers', 'entityAccounts', 'paymentTypeColumns', 'supplementaryStructure'])
+
+def CompileEntityRegistry(entities, structureNames, paymentTypeColumns, supplementaryStructure):
+    '''
+    Compiles (company, currency, account, structure) entities into an EntityRegistry of lookup tables, so
+    that a report can be aggregated by coding each of its rows with the position of its entity (with a
+    hash lookup over every row at once) and scatter-adding its amounts, however many entities there are.
+    Entities are identified by their (company, currency) pair in the proposals and registers, and by their
+    account in the treasura report. Several entities may share an account. The account structure named
+    supplementaryStructure, whose pooled proposed outflows go into the supplementary data, is resolved to
+    its position, so that a registry without it is rejected before anything is sent or written.
+    '''
+    companies, currencies, accounts, structures = (tuple(column) for column in zip(*entities))
+    pairs = MultiIndex.from_arrays([list(companies), list(currencies)])
+    if not pairs.is_unique:
+        raise ValueError("Every Entity Must Have A Different Company And Currency")
+    if not all(0 <= structure < len(structureNames) for structure in structures):
+        raise ValueError("Every Entity Must Belong To One Of The Account Structures")
+    if supplementaryStructure not in structureNames:
+        raise ValueError("The Supplementary Data Must Come From One Of The Account Structures")
+    accountNumbers, entityAccounts = unique(array([int(account) for account in accounts], dtype = int64), return_inverse = True)
+    return EntityRegistry(companies, currencies, accounts, array(structures, dtype = int64), tuple(structureNames), pairs,
+                          Index(accountNumbers), entityAccounts, dict(paymentTypeColumns), list(structureNames).index(supplementaryStructure))
+
+def LoadEntityRegistry(registryPath = None):
+    '''
+    Loads the entity registry at registryPath (entityRegistryPath by default), a JSON file of the form
+        {"structures": ["Structure", ...],
+         "supplementaryStructure": "Structure",
+         "paymentTypes": {"EFT": "EFT", "WIRE": "Wire", "SCOCA": "Cheque", ...},
+         "entities": [{"company": "1000", "currency": "USD", "account": "123456789", "structure": "Structure"}, ...]}
+    where the payment types map the tokens found in report filenames to the EFT, Wire or Cheque columns,
+    and the supplementary structure names the structure whose pooled proposed outflows go into the
+    supplementary data.
+    Entities are written to the database in the order they are listed. Falls back to the defaults at the
+    top of this file when there is no registry.
+    '''
+    registryPath = entityRegistryPath if registryPath is None else registryPath
+    if not path.exists(registryPath):
+        return CompileEntityRegistry(defaultEntities, structureNames, paymentTypeColumns, supplementaryStructure)
+    with open(registryPath, 'r') as f:
+        registry = json_load(f)
+    columns = {'EFT': 6, 'Wire': 7, 'Cheque': 8}
+    structures = {name: structure for structure, name in enumerate(registry['structures'])}
+    entities = [(str(entity['company']), str(entity['currency']), str(entity['account']), structures[entity['structure']]) for entity in registry['entities']]
+    return CompileEntityRegistry(entities, registry['structures'], {token: columns[column] for token, column in registry['paymentTypes'].items()},
+                                 registry.get('supplementaryStructure'))
+
+def CurrentRegistry():
+    '''
+    Returns the entity registry of the run, loading it the first time it is needed.
+    '''
+    global entityRegistry
+    if entityRegistry is None:
+        entityRegistry = LoadEntityRegistry()
+    return entityRegistry
+
+def EntityCodes(registry, companies, currencies):
+    '''
+    Returns the position in the registry of the entity of every (company, currency) row, or -1 for rows
+    of companies that are not tracked. Company codes are matched as text, since numeric codes are read
+    from the reports as integers, or as floats when the column has blanks. Each distinct code is only
+    converted once.
+    '''
+    def CodeText(code):
+        if isinstance(code, float) and code.is_integer():
+            return str(int(code))
+        return str(code)
+
+    positions, codes = factorize(companies)
+    codeTexts = array([CodeText(code) for code in codes] + [''], dtype = object)
+    return registry.pairs.get_indexer(MultiIndex.from_arrays([codeTexts[positions], currencies]))
+
+def RegisterGroupSums(dataframe, registry):
+    '''
+    Aggregates a register with a single scatter-add over (entity, payment method code) codes.
+    Returns the negated EFT/ACH, check and wire totals of each entity in the registry, whether that
+    entity appears in the register at all, and how many of the entities' payments have an unclassified
+    payment method.
+    '''
+    entities = len(registry.companies)
+    codes = EntityCodes(registry, dataframe['$$$$$$$$$$'], dataframe['$$$$$$$$$$'])
+    methods = ClassifyPaymentMethods(dataframe['$$$$$$$$$$']).to_numpy()
+    amounts = nan_to_num(to_numeric(dataframe['$$$$$$$$$$'], errors = 'coerce').to_numpy(dtype = float64))
+    tracked = codes >= 0
+    classified = tracked & (methods >= 0)
+    totals = bincount(codes[classified] * 3 + methods[classified], weights = amounts[classified], minlength = entities * 3).reshape(entities, 3)
+    sums = 0 - totals #rather than negating, which would turn empty totals into -0.0
+    present = bincount(codes[tracked], minlength = entities) > 0
+    unclassified = int((tracked & (methods < 0)).sum())
+    return sums, present, unclassified
+
+def TreasuraGroupSums(treasData, registry):
+    '''
+    Aggregates the treasura AP EFT report with a single scatter-add over (account, subcategory) codes into
+    the AP EFT, AP Wires and AP Cheques ledger totals of each entity in the registry.
+    Accounts are matched as integers, so the account column never has to be converted to strings.
+    Also returns the subcategories, other than the three above, that appear for our accounts.
+    '''
+    subcategories = ['AP EFT', 'AP Wires', 'AP Cheques']
+    accountCount = len(registry.accountNumbers)
+    codes = registry.accountNumbers.get_indexer(to_numeric(treasData['ACCOUNT'], errors = 'coerce'))
+    kinds = Index(subcategories).get_indexer(treasData['SUBCATEGORY'])
+    amounts = treasData['LEDGER AMOUNT'].to_numpy(dtype = float64)
+    ourRows = (codes >= 0) & (amounts == amounts)
+    tracked = ourRows & (kinds >= 0)
+    totals = bincount(codes[tracked] * 3 + kinds[tracked], weights = amounts[tracked], minlength = accountCount * 3).reshape(accountCount, 3)
+    sums = totals[registry.entityAccounts]
+    unexpected = sorted(str(subcategory) for subcategory in set(treasData['SUBCATEGORY'][ourRows]) - set(subcategories))
+    return sums, unexpected
+
+def PaymentType(fileName, registry = None):
+    '''
+    Returns the payment type token (EFT, ACH, WIRE, SCOCA, ...) found in the filename of a SAP S4 report,
+    or None if the filename has none of the tokens in the registry.
+    '''
+    registry = CurrentRegistry() if registry is None else registry
+    for paymentType in registry.paymentTypeColumns:
+        if paymentType in fileName:
+            return paymentType
+    return None
+
+def ProposalPaymentColumn(fileName, registry = None):
+    '''
+    Returns the column of the surveillance database (EFT/ACH, WIRE or cheque) that a proposal feeds into,
+    based on the payment type found in its filename. Returns None if the payment type is not tracked.
+    '''
+    registry = CurrentRegistry() if registry is None else registry
+    return registry.paymentTypeColumns.get(PaymentType(fileName, registry))
+
+def ProposalGroupSums(dataframe, registry):
+    '''
+    Aggregates a proposal in a single pass over its rows, rather than filtering it once per company.
+    Payments with an error message are masked out once, then the remaining amounts are scatter-added
+    onto the entity of each row, as matched by EntityCodes.
+    Returns the NO_ERRORS amounts of each entity in the registry, in the order of the registry: the
+    '$$$$$$$$$$' amounts pooled by the proposed outflows email and the 'Net Amount in FC' amounts
+    recorded in the database, along with whether that entity appears in the proposal at all (error or not).
+    '''
+    entities = len(registry.companies)
+    codes = EntityCodes(registry, dataframe['$$$$$$$$$$'], dataframe['$$$$$$$$$$'])
+    noErrors = PaymentErrorFilter(dataframe)
+    tracked = codes >= 0
+
+    def Sums(column):
+        amounts = nan_to_num(to_numeric(dataframe[column].where(noErrors), errors = 'coerce').to_numpy(dtype = float64))
+        return bincount(codes[tracked], weights = amounts[tracked], minlength = entities)
+
+    present = bincount(codes[tracked], minlength = entities) > 0
+    return Sums('$$$$$$$$$$'), Sums('Net Amount in FC'), present
+
+def ScrapeProposal(filePath, registry):
+    '''
+    Parses a single proposal and returns its partial sums, as given by ProposalGroupSums.
+    '''
+    data = ReadReport(filePath, reader = ReadSAPReport, sheets = (0,),
+                      columns = (('$$$$$$$$$$', 'category'), ('$$$$$$$$$$', 'category'), ('$$$$$$$$$$', 'category'),
+                                 ('$$$$$$$$$$', 'float64'), ('Net Amount in FC', 'float64')))
+    return ProposalGroupSums(data, registry)
+
+def ScrapeRegister(filePath, registry):
+    '''
+    Parses a single payment register and returns the negated EFT/ACH, check and wire totals of each
+    entity, along with whether that entity appears in the register at all and the number of its payments
+    whose payment method could not be classified.
+    '''
+    data = ReadReport(filePath, reader = ReadSAPReport, sheets = (2, 1), #usually data is on second sheet
+                      columns = (('$$$$$$$$$$', 'category'), ('$$$$$$$$$$', 'category'), ('$$$$$$$$$$', 'category'), ('$$$$$$$$$$', 'float64')))
+    return RegisterGroupSums(data, registry)
+
+def ScrapeTreasura(filePath, registry):
+    '''
+    Parses the treasura AP EFT report and returns the AP EFT, AP Wires and AP Cheques ledger totals
+    of each entity, along with any unexpected subcategories found for their accounts.
+    '''
+    treasData = ReadReport(filePath, reader = StreamTreasuraReport, header = 6, accounts = tuple(registry.accountNumbers))
+    return TreasuraGroupSums(treasData, registry)
+
+def IngestionPool():
+    '''
+    Returns the pool of ingestion worker processes, starting it the first time it is needed. The pool is kept
+    for the rest of the run, so that the forecast and database passes, and every date of a backfill, share
+    the same workers instead of each starting their own.
+    '''
+    global ingestionPool
+    if ingestionPool is None:
+        ingestionPool = ProcessPoolExecutor(max_workers = ingestionWorkers)
+        atexit_register(ingestionPool.shutdown)
+    return ingestionPool
+
+def RecordedScrape(scraper, filePath, *args):
+    '''
+    Runs a scraper in an ingestion worker and returns its result along with the report parses it added to
+    the worker's run record, so that they can be added to the run record of the main process.
+    '''
+    runRecord['parses'].clear()
+    return scraper(filePath, *args), list(runRecord['parses'])
+
+def PipelineKey(scraper, filePath, size):
+    '''
+    Identifies the scrape of a report by the scraper, the report's normalized path and its size, so that a
+    report that has been downloaded again with new contents is not served an earlier scrape.
+    '''
+    return scraper.__name__, path.normcase(path.abspath(filePath)), size
+
+def StagedScrape(scraper, filePath, stagedPath, *args):
+    '''
+    Runs a scraper in an ingestion worker over a report that is still being copied to filePath on the
+    corporate drive, reading the report from its local staged copy at stagedPath instead.
+    '''
+    normalizedPath = path.normcase(path.abspath(filePath))
+    stagedReports[normalizedPath] = stagedPath
+    try:
+        return RecordedScrape(scraper, filePath, *args)
+    finally:
+        del stagedReports[normalizedPath]
+        normalizedStagedPath = path.normcase(path.abspath(stagedPath))
+        for stagedKey in [cached for cached in parsedReports if cached[0] == normalizedStagedPath]: #the staged copy is removed after the download
+            del parsedReports[stagedKey]
+
+def PipelinedScrape(scraper, filePath):
+    '''
+    Returns the scrape of a report that was started while it was being downloaded, if there is one, and
+    removes it from pipelinedScrapes.
+    '''
+    if not pipelinedScrapes:
+        return None
+    try:
+        return pipelinedScrapes.pop(PipelineKey(scraper, filePath, path.getsize(filePath)), None)
+    except OSError:
+        return None
+
+def DiscardPipelinedScrapes():
+    '''
+    Cancels the scrapes in pipelinedScrapes that nobody picked up, and forgets them, so that they do not
+    pile up over the polls of a watch.
+    '''
+    for scrape in pipelinedScrapes.values():
+        scrape.cancel()
+    pipelinedScrapes.clear()
+
+def IngestFiles(tasks):
+    '''
+    Runs each (scraper, filePath, args) task and returns a list of (result, error) pairs in the same order
+    as the tasks, where error is None if the file was analyzed successfully. A file that fails to be
+    analyzed never prevents the other files from being analyzed.
+    Parsing the reports is CPU bound, so when there is more than one task they are fanned out to a pool of
+    ingestionWorkers processes. Only the partial sums of each file are sent back to this process.
+    Files that fail are added to the parses of the run record with their error.
+    Reports that were already scraped while they were being downloaded are not parsed again.
+    '''
+    results = []
+    pipelined = [PipelinedScrape(scraper, filePath) for scraper, filePath, _ in tasks]
+    if (len(tasks) > 1 and ingestionWorkers != 1) or any(future is not None for future in pipelined):
+        pool = IngestionPool()
+        futures = [future if future is not None else pool.submit(RecordedScrape, scraper, filePath, *args)
+                   for future, (scraper, filePath, args) in zip(pipelined, tasks)]
+        for future in futures:
+            try:
+                result, parses = future.result()
+                runRecord['parses'].extend(parses)
+                results.append((result, None))
+            except Exception as e:
+                results.append((None, e))
+    else:
+        for scraper, filePath, args in tasks:
+            try:
+                results.append((scraper(filePath, *args), None))
+            except Exception as e:
+                results.append((None, e))
+    for (scraper, filePath, args), (result, error) in zip(tasks, results):
+        if error is not None:
+            runRecord['parses'].append({'file': path.basename(filePath), 'error': repr(error)})
+    return results
+
 def ToVisualFormat(num):
     '''
     Makes currency values easier to look at.
@@ -454,226 +1532,492 @@ def ToVisualFormat(num):
     else:
         return body + deci
 
-def DataAgreggator_F(companyList, currencyList, presentDayProposals, propDir, propFocDate):
+def DataAgreggator_F(registry, presentDayProposals, propDir, propFocDate):
     '''
     Aggregates all of the appropriate data in the proposals and combines it into an output that
     can be used for the proposed outflows email.
     THIS FUNCTION IS CONCERNED WITH THE CURRENT DATE PROPOSALS, WHICH ARE PROPOSING PAYMENTS FOR
     THE FOLLOWING BUSINESS DAY.
-    Then updates the supplementary data to be referenced by the morning account info spreadsheet.
     Concludes by returning the names of the proposals analyzed so that they can be included on the
-    email sent out to analysts.
+    email sent out to analysts, along with the pooled outflows of each account structure, which go into
+    the supplementary data referenced by the morning account info spreadsheet when the run is committed.
     '''
 
-    def PropDataScraper_F(companyList, currencyList, presentDayProposals, propDir, propFocDate):
-        pooledPropOutflows = zeros(3, float64)
+    def PropDataScraper_F(registry, presentDayProposals, propDir, propFocDate):
+        structureCount = len(registry.structureNames)
+        pooledPropOutflows = zeros(structureCount, float64)
         analyzedNames = ""
-        for file in presentDayProposals:
-            try:
-                data = read_excel(propDir + "\\" + file)
-                data.columns = NameStripper(data.columns) 
-                counter = 0
-                for companyCode, currency in zip(companyList, currencyList):
-                    tempData = data[CompanyFilter(data, companyCode, currency)]
-                    if len(tempData) > 0:
-                        if counter < 2:
-                            index = 0
-                        elif counter < 5:
-                            index = 1
-                        else:
-                            index = 2
-                        pooledPropOutflows[index] += tempData[PaymentErrorFilter(tempData)]['$$$$$$$$$$'].sum()
-                    counter += 1
+        tasks = [(ScrapeProposal, path.join(propDir, file), (registry,)) for file in presentDayProposals]
+        for file, (result, error) in zip(presentDayProposals, IngestFiles(tasks)):
+            if error is None:
+                sums, _, _ = result #the amounts pooled by the proposed outflows email
+                pooledPropOutflows += bincount(registry.structures, weights = sums, minlength = structureCount)
 
                 analyzedNames += '\t' + file + '\n' 
 
-            except Exception as e:
+            else:
                 print(f"ERROR analyzing {file}")
-                print(e)
+                print(error)
                 analyzedNames += '\t' + 'ERROR analyzing: ' + file + '\n'
 
         return pooledPropOutflows, analyzedNames
 
-    pooledPropOutflows, analyzedNames = PropDataScraper_F(companyList, currencyList, presentDayProposals, propDir, propFocDate) 
-    structures = ['$$$$$$$$$$', '$$$$$$$$$$', '$$$$$$$$$$']
-    messageForEmail = "\n"
-    for struc, pool in zip(structures, pooledPropOutflows):
-        messageForEmail += '\t' + struc + ": " + ToVisualFormat(pool) + '\n\n'
+    pooledPropOutflows, analyzedNames = PropDataScraper_F(registry, presentDayProposals, propDir, propFocDate) 
+    messageForEmail = PooledOutflowsMessage(registry, pooledPropOutflows)
 
-    chmod(depositPath, S_IWUSR | S_IWOTH)
-    DATABASE_WORKBOOK = load_workbook(depositPath)
-    supDataSheet = DATABASE_WORKBOOK['$$$$$$$$$$']
-    titleCell = supDataSheet.cell(row = 1, column = 1)
-    title, date = titleCell.value.split(":")
-    titleCell.value = title + ":  " + propFocDate
-    amountCell = supDataSheet.cell(row = 1, column = 2)
-    amountCell.value = pooledPropOutflows[1]
-    DATABASE_WORKBOOK.save(depositPath)
-    chmod(depositPath, S_IRUSR | S_IROTH)
+    return messageForEmail, analyzedNames, pooledPropOutflows
 
-    return messageForEmail, analyzedNames
+def PooledOutflowsMessage(registry, pooledPropOutflows):
+    '''
+    Lists the pooled proposed outflows of each account structure for the proposed outflows email.
+    '''
+    messageForEmail = "\n"
+    for struc, pool in zip(registry.structureNames, pooledPropOutflows):
+        messageForEmail += '\t' + struc + ": " + ToVisualFormat(pool) + '\n\n'
+    return messageForEmail
 
-def DataAgreggator_DB(companyList, currencyList, accountList, propFlaggedFiles, propDir, propRecvDate, regFlaggedFiles, regDir, regRecvDate, treasFile):
+def DataAgreggator_DB(registry, propFlaggedFiles, propDir, propRecvDate, regFlaggedFiles, regDir, regRecvDate, treasFile):
     '''
     Aggregates all of the appropriate data in the proposals and registers and combines it into an output that
     can be used to update the database.
     THIS FUNCTION IS CONCERNED WITH THE PREVIOUS PREVIOUS BUSINESS DAY'S PROPOSALS, so that these can be compared
     with the previous business day's register and treasura AP EFT report (this report is for the previous business
     day but SENT ON THE CURRENT DAY).
+    There is one row of output for each entity in the registry, in the order of the registry.
     '''
-    def PropDataScraper_DB(companyList, currencyList, propFlaggedFiles, propDir, propRecvDate):
-        dataForDataBase = empty([8, 9], dtype = object)
-        dataForDataBase[:, 2] = full((8,), propRecvDate, dtype = object)
-        dataForDataBase[:, 4] = companyList
-        dataForDataBase[:, 5] = currencyList
-        dataForDataBase[:, [6, 7, 8]] = zeros((8, 3), dtype = float64)
-
-        for file in propFlaggedFiles:
-            try:
-                data = read_excel(propDir + '/' + file)
-                data.columns = NameStripper(data.columns)
-                counter = 0
-                for companyCode, currency in zip(companyList, currencyList):
-                    tempData = data[CompanyFilter(data, companyCode, currency)]
-                    if len(tempData) > 0:
-                        if dataForDataBase[counter, 0] == None:
-                            dataForDataBase[counter, 0] = file
-                        else:
-                            dataForDataBase[counter, 0] += " | " + file
-                        if 'EFT' in file or 'ACH' in file or 'FRTCE' in file or 'FRTUA' in file:
-                            dataForDataBase[counter, 6] += tempData[PaymentErrorFilter(tempData)]['Net Amount in FC'].sum()
-                        elif 'WIRE' in file:
-                            dataForDataBase[counter, 7] += tempData[PaymentErrorFilter(tempData)]['Net Amount in FC'].sum()
-                        elif 'SCOCA' in file or 'BMOUS' in file or 'FRTCC' in file or 'FRTUC' in file or 'CBRCC' in file:
-                            dataForDataBase[counter, 8] += tempData[PaymentErrorFilter(tempData)]['Net Amount in FC'].sum()
-                        else:
-                            pass
+    entities = len(registry.companies)
+
+    def PropDataScraper_DB(registry, propFlaggedFiles, propResults, propRecvDate):
+        dataForDataBase = empty([entities, 9], dtype = object)
+        dataForDataBase[:, 2] = full((entities,), propRecvDate, dtype = object)
+        dataForDataBase[:, 4] = registry.companies
+        dataForDataBase[:, 5] = registry.currencies
+        dataForDataBase[:, [6, 7, 8]] = zeros((entities, 3), dtype = float64)
+
+        for file, (result, error) in zip(propFlaggedFiles, propResults):
+            if error is None:
+                _, sums, present = result
+                for counter in present.nonzero()[0]:
+                    if dataForDataBase[counter, 0] == None:
+                        dataForDataBase[counter, 0] = file
                     else:
-                        pass
-                    counter += 1
+                        dataForDataBase[counter, 0] += " | " + file
+                paymentColumn = ProposalPaymentColumn(file, registry)
+                if paymentColumn is not None:
+                    dataForDataBase[:, paymentColumn] += sums
 
                 print(f"Analyzed {file} for Surveillance Database")
 
-            except Exception as e:
+            else:
                 print(f"ERROR analyzing {file} for Surveillance Database")
-                print(e)
+                print(error)
 
         return dataForDataBase
 
-    def RegDataScraper(companyList, currencyList, regFlaggedFiles, regDir, regRecvDate):
-
-        def Reg_EFTACHFilter(dataframe):
-            '''
-            Returns index that fetches only ACH or EFT payments.
-            '''
-            def Filter(s):
-                return 'eft' in s.lower() or 'ach' in s.lower()
-
-            return dataframe['$$$$$$$$$$'].apply(Filter)
-
-        def Reg_CheckFilter(dataframe):
-            '''
-            Returns index that fetches only check payments.
-            '''
-            def Filter(s):
-                return 'check' in s.lower()
-
-            return dataframe['$$$$$$$$$$'].apply(Filter)
+    def RegDataScraper(regFlaggedFiles, regResults, regRecvDate):
+        dataForDataBase = empty([entities, 5], dtype = object)
+        dataForDataBase[:, 1] = full((entities,), regRecvDate, dtype = object)
+        dataForDataBase[:, [2, 3, 4]] = zeros((entities, 3), dtype = float64)
 
-        def Reg_WireFilter(dataframe):
-            '''
-            Returns index that fetches only wire payments.
-            '''
-            def Filter(s):
-                return 'wire' in s.lower()
-
-            return dataframe['$$$$$$$$$$'].apply(Filter)
-
-        dataForDataBase = empty([8, 5], dtype = object)
-        dataForDataBase[:, 1] = full((8,), regRecvDate, dtype = object)
-        dataForDataBase[:, [2, 3, 4]] = zeros((8, 3), dtype = float64)
-
-        for file in regFlaggedFiles: #now we are analyzing registers
-            try:
-                data = read_excel(regDir + '/' + file, sheet_name = 2) #usually data is on second sheet
-                if '$$$$$$$$$$' in data.columns:
-                    pass
-                else:
-                    data = read_excel(regDir + '/' + file, sheet_name = 1) 
-                    assert '$$$$$$$$$$' in data.columns, "'$$$$$$$$$$' Column Not Found in " + file
-
-                data.columns = NameStripper(data.columns)
-                counter = 0
-                for companyCode, currency in zip(companyList, currencyList):
-                    tempData = data[CompanyFilter(data, companyCode, currency, 'reg')]
-                    if len(tempData) > 0:
-                        dataForDataBase[counter, 0] = file
-                        dataForDataBase[counter, 2] -= tempData[Reg_EFTACHFilter(tempData)]['$$$$$$$$$$'].sum()
-                        dataForDataBase[counter, 3] -= tempData[Reg_CheckFilter(tempData)]['$$$$$$$$$$'].sum()
-                        dataForDataBase[counter, 4] -= tempData[Reg_WireFilter(tempData)]['$$$$$$$$$$'].sum()
-                    counter += 1
+        for file, (result, error) in zip(regFlaggedFiles, regResults): #now we are analyzing registers
+            if error is None:
+                sums, present, unclassified = result
+                dataForDataBase[present, 0] = file
+                dataForDataBase[:, [2, 3, 4]] += sums
+                if unclassified > 0:
+                    print(f"{unclassified} Payments in {file} Have an Unclassified Payment Method")
 
                 print(f"Analyzed {file} for Surveillance Database")
 
-            except Exception as e:
+            else:
                 print(f"ERROR analyzing {file} for Surveillance Database")
-                print(e)
+                print(error)
 
         return dataForDataBase
 
-    def TreasDataScraper(accountList, treasFile, regRecvDate):
+    def TreasDataScraper(treasFile, treasResult, regRecvDate):
         '''
         Analyzes the data contained in the treasura AP EFT reports.
         '''
-        dataForDataBase = empty([8, 4], dtype = object)
-        dataForDataBase[:, 3] = full((8,), regRecvDate, dtype = object)
-        dataForDataBase[:, :3] = zeros([8, 3])
-
-        try:
-            treasData = read_excel(treasFile, header = 6)
-            treasData = treasData.loc[:, ~treasData.columns.str.contains('Unnamed:')]
-            treasData = treasData[~treasData['LEDGER AMOUNT'].isna()]
-            treasData["ACCOUNT"] = treasData["ACCOUNT"].astype(int64).astype(str)
-
-            subcategories = ['AP EFT', 'AP Wires', 'AP Cheques']
-            for accountIndex, accountNumber in enumerate(accountList):
-                tempData1 = treasData[treasData["ACCOUNT"] == accountNumber]
-                for subIndex, subcategory in enumerate(subcategories):
-                    tempData2 = tempData1[tempData1['SUBCATEGORY'] == subcategory]
-                    dataForDataBase[accountIndex, subIndex] += tempData2['LEDGER AMOUNT'].sum()
-
-            fn = treasFile.split('\\')[-1]
+        dataForDataBase = empty([entities, 4], dtype = object)
+        dataForDataBase[:, 3] = full((entities,), regRecvDate, dtype = object)
+        dataForDataBase[:, :3] = zeros([entities, 3])
+
+        result, error = treasResult
+        if error is None:
+            sums, unexpected = result
+            dataForDataBase[:, :3] += sums
+            if unexpected:
+                print(f"Unexpected Subcategories in the Treasura Report: {', '.join(unexpected)}")
+
+            fn = path.basename(treasFile)
             print(f"Analyzed {fn} for Surveillance Database")
 
-        except Exception as e:
+        else:
             print("ERROR Analyzing the Treasura Report")
-            print(e)
+            print(error)
             print("Has the Format of the Treasura Report Changed?")
 
         return dataForDataBase
 
-    finalData = empty([8, 16], dtype = object)
-    finalData[:, :9] = PropDataScraper_DB(companyList, currencyList, propFlaggedFiles, propDir, propRecvDate) 
-    finalData[:, [1, 3, 9, 10, 11]] = RegDataScraper(companyList, currencyList, regFlaggedFiles, regDir, regRecvDate) 
-    finalData[:, 12:] = TreasDataScraper(accountList, treasFile, regRecvDate) 
+    propTasks = [(ScrapeProposal, path.join(propDir, file), (registry,)) for file in propFlaggedFiles]
+    regTasks = [(ScrapeRegister, path.join(regDir, file), (registry,)) for file in regFlaggedFiles]
+    treasTasks = [(ScrapeTreasura, treasFile, (registry,))]
+    results = IngestFiles(propTasks + regTasks + treasTasks)
+    propResults = results[:len(propTasks)]
+    regResults = results[len(propTasks):len(propTasks) + len(regTasks)]
+
+    finalData = empty([entities, 16], dtype = object)
+    finalData[:, :9] = PropDataScraper_DB(registry, propFlaggedFiles, propResults, propRecvDate) 
+    finalData[:, [1, 3, 9, 10, 11]] = RegDataScraper(regFlaggedFiles, regResults, regRecvDate) 
+    finalData[:, 12:] = TreasDataScraper(treasFile, results[-1], regRecvDate) 
 
     return finalData
 
-def ExecuteProposedOutflowsAndDatabaseUpdates(wd, propDir, regDir, treasDir, propFocDate, currentDate, priorBusinessDay, propRecvDate_DB):
+def IsoDate(value):
+    '''
+    Converts a mm/dd/yyyy date string (or a date read back from the workbook) into a yyyy-mm-dd string,
+    which sorts and indexes correctly in the surveillance store.
+    '''
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d")
+    try:
+        return datetime.strptime(str(value).strip(), "%m/%d/%Y").strftime("%Y-%m-%d")
+    except ValueError:
+        return str(value)
+
+def OpenSurveillanceStore(storePath = None, seedWorkbook = None):
+    '''
+    Opens the append-only surveillance store, an SQLite database holding one row per company per
+    update, with the same columns as the 'Database' sheet. Rows are keyed on their register date and
+    position within the update, and indexed by date, company and currency, so that writing a day's
+    rows costs the same no matter how much history has built up.
+    If the store is new and a seed workbook is given, the history in its 'Database' sheet is imported.
+    '''
+    connection = sqlite_connect(storePath if storePath is not None else surveillanceStorePath)
+    isNew = connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'Surveillance'").fetchone() is None
+    with connection:
+        connection.execute(f"""CREATE TABLE IF NOT EXISTS Surveillance (UpdateDate TEXT, RowIndex INTEGER NOT NULL, Account TEXT,
+                           {', '.join(databaseColumns)}, PRIMARY KEY (RegisterDate, RowIndex))""")
+        connection.execute("CREATE INDEX IF NOT EXISTS SurveillanceByDateCompany ON Surveillance (RegisterDate, CompanyCode, Currency)")
+    if isNew and seedWorkbook is not None and path.exists(seedWorkbook):
+        ImportDatabaseSheet(connection, seedWorkbook)
+    return connection
+
+def SurveillanceRecords(updateDate, finalData, accountList):
+    '''
+    Converts a block of surveillance data (as returned by DataAgreggator_DB) into rows of the store.
+    '''
+    records = []
+    for rowIndex in range(finalData.shape[0]):
+        row = list(finalData[rowIndex])
+        for j in [2, 3, 15]:
+            row[j] = IsoDate(row[j])
+        for j in range(6, 15):
+            row[j] = float(row[j]) if isinstance(row[j], (int, float)) else None
+        account = accountList[rowIndex] if accountList is not None and rowIndex < len(accountList) else None
+        records.append([IsoDate(updateDate), rowIndex, account] + row)
+    return records
+
+def AppendSurveillanceRows(connection, blocks, accountList):
+    '''
+    Appends blocks of surveillance data, given as (updateDate, finalData) pairs, to the store in a single
+    transaction. Re-running a day replaces that day's rows instead of duplicating them.
+    '''
+    records = [record for updateDate, finalData in blocks for record in SurveillanceRecords(updateDate, finalData, accountList)]
+    placeholders = ', '.join('?' * (3 + len(databaseColumns)))
+    with connection:
+        connection.executemany(f"INSERT OR REPLACE INTO Surveillance VALUES ({placeholders})", records)
 
-    propFilenames = listdir(propDir) 
-    regFilenames = listdir(regDir) 
-    treasFilenames = listdir(treasDir) 
+def ImportDatabaseSheet(connection, workbookPath):
+    '''
+    One-off migration of the history in the 'Database' sheet into the store. The sheet holds blocks of
+    rows, newest first, separated by blank rows.
+    '''
+    from openpyxl import load_workbook
+    workbook = load_workbook(workbookPath, read_only = True, data_only = True)
+    try:
+        records = []
+        rowIndex = 0
+        for row in workbook['Database'].iter_rows(min_row = 2, max_col = len(databaseColumns), values_only = True):
+            if all(value is None for value in row):
+                rowIndex = 0
+                continue
+            finalRow = empty([1, len(databaseColumns)], dtype = object)
+            finalRow[0, :len(row)] = row
+            records += [[None, rowIndex] + record[2:] for record in SurveillanceRecords(None, finalRow, None)]
+            rowIndex += 1
+    finally:
+        workbook.close()
+    placeholders = ', '.join('?' * (3 + len(databaseColumns)))
+    with connection:
+        connection.executemany(f"INSERT OR IGNORE INTO Surveillance VALUES ({placeholders})", records)
+    print(f"Imported {len(records)} Rows From The 'Database' Sheet Into The Surveillance Store")
 
-    companyList = ['$$$$$$$$$$', '$$$$$$$$$$', '$$$$$$$$$$', '$$$$$$$$$$', '$$$$$$$$$$', '$$$$$$$$$$', '$$$$$$$$$$', '$$$$$$$$$$'] 
-    currencyList = ['USD', 'USD', 'CAD', 'CAD', 'CAD', 'USD', 'USD', 'USD']
-    accountList = ['$$$$$$$$$$', '$$$$$$$$$$', '$$$$$$$$$$', '$$$$$$$$$$', '$$$$$$$$$$', '$$$$$$$$$$', '$$$$$$$$$$', '$$$$$$$$$$']
+def DatabaseColumnStyle(column):
+    '''
+    Returns the name of the named style used by a column of the 'Database' sheet.
+    '''
+    if column < 2:
+        return 'Surveillance General'
+    elif column < 4 or column == 15:
+        return 'Surveillance Date'
+    elif column < 6:
+        return 'Surveillance General'
+    else:
+        return 'Surveillance Amount'
 
-    #Daily Outflow Proposals Program Implementation
-    presentDayProposals = SAPFileDetector(propFilenames, propFocDate, 'Proposal') 
-    messageForEmail, analyzedNames = DataAgreggator_F(companyList, currencyList, presentDayProposals, propDir, propFocDate) 
-    print("Daily Proposed Outflows Acquired") ; print()
+def RegisterDatabaseStyles(workbook):
+    '''
+    Adds the named styles of the 'Database' sheet to a workbook if it does not have them yet. Cells then
+    share one style record per column, instead of each cell getting its own alignment and number format.
+    '''
+    from openpyxl.styles import Alignment, NamedStyle
+    #Built-in formats: https://openpyxl.readthedocs.io/en/stable/_modules/openpyxl/styles/numbers.html
+    cellFormats = {'Surveillance General': 'General',
+                   'Surveillance Date': 'mm-dd-yy',
+                   'Surveillance Amount': r'$ #,###.00;[red]$ (#,###.00);$ 0.00;'}
+    for name, cellFormat in cellFormats.items():
+        if name not in workbook.named_styles:
+            workbook.add_named_style(NamedStyle(name = name, number_format = cellFormat, alignment = Alignment(horizontal = 'center')))
+
+def ApplySupplementaryData(workbook, propFocDate, amount):
+    '''
+    Updates the supplementary data referenced by the morning account info spreadsheet, in a loaded workbook.
+    '''
+    supDataSheet = workbook['$$$$$$$$$$']
+    titleCell = supDataSheet.cell(row = 1, column = 1)
+    title, date = titleCell.value.split(":")
+    titleCell.value = title + ":  " + propFocDate
+    amountCell = supDataSheet.cell(row = 1, column = 2)
+    amountCell.value = amount
+
+def ApplyDatabaseBlocks(workbook, blocks):
+    '''
+    Prepends blocks of surveillance data, given as (updateDate, finalData) pairs in the order they were
+    produced, to the 'Database' sheet of a loaded workbook, which is kept as a view of the surveillance
+    store for the analysts. The newest block ends up on top, with each block preceded by a blank row.
+    Blocks whose register date is already among the newest rows of the sheet were written by a run that
+    failed before recording its dates, and are skipped so that rerunning it does not duplicate them.
+    '''
+    RegisterDatabaseStyles(workbook)
+    dataSheet = workbook['Database']
+    rowCount = sum(finalData.shape[0] + 1 for _, finalData in blocks)
+    writtenDates = {IsoDate(value) for value, in dataSheet.iter_rows(min_row = 2, max_row = rowCount + 1, min_col = 4, max_col = 4, values_only = True) if value is not None}
+    blocks = [(updateDate, finalData) for updateDate, finalData in blocks if IsoDate(finalData[0, 3]) not in writtenDates]
+    if not blocks:
+        return
+
+    dataSheet.insert_rows(idx = 2, amount = sum(finalData.shape[0] + 1 for _, finalData in blocks))
+    styles = [DatabaseColumnStyle(j) for j in range(len(databaseColumns))]
+    rowNumber = 2
+    for _, finalData in reversed(blocks):
+        for row in finalData.tolist():
+            rowNumber += 1
+            for j, (value, style) in enumerate(zip(row, styles)):
+                cell = dataSheet.cell(row = rowNumber, column = j + 1, value = value)
+                cell.style = style
+        rowNumber += 1
+
+def SaveWorkbookAtomically(workbook, filePath):
+    '''
+    Saves a workbook to a temporary file next to filePath, flushes it to disk, then swaps it in with a
+    single atomic replace, so that filePath always holds either the old or the new workbook in full.
+    The workbook is left read only, like the other files the program writes to.
+    '''
+    tempPath = f"{filePath}.{uuid4().hex}.tmp"
+    try:
+        workbook.save(tempPath)
+        with open(tempPath, 'rb+') as f:
+            fsync(f.fileno())
+        if path.exists(filePath):
+            chmod(filePath, S_IWUSR | S_IWOTH) #a read only file cannot be replaced on Windows
+        replace(tempPath, filePath)
+    except BaseException:
+        if path.exists(tempPath):
+            remove(tempPath)
+        raise
+    chmod(filePath, S_IRUSR | S_IROTH)
+
+def CommitDepositWorkbook(blocks, supplementary = None):
+    '''
+    Loads the workbook at depositPath once, prepends the blocks to its 'Database' sheet and, when given
+    as a (propFocDate, amount) pair, updates its supplementary data, then saves it atomically.
+    '''
+    from openpyxl import load_workbook
+    DATABASE_WORKBOOK = load_workbook(depositPath)
+    if supplementary is not None:
+        ApplySupplementaryData(DATABASE_WORKBOOK, *supplementary)
+    if blocks:
+        ApplyDatabaseBlocks(DATABASE_WORKBOOK, blocks)
+    SaveWorkbookAtomically(DATABASE_WORKBOOK, depositPath)
+
+def ExportSurveillanceStore(connection, exportPath):
+    '''
+    Exports the whole surveillance store to a workbook laid out like the 'Database' sheet (newest first,
+    with a blank row between each update). The workbook is written in openpyxl's write-only mode while
+    the rows are streamed out of the store, so memory use stays flat however long the history is.
+    '''
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+
+    def SheetDate(value):
+        try:
+            return datetime.strptime(value, "%Y-%m-%d").strftime("%m/%d/%Y")
+        except (TypeError, ValueError):
+            return value
+
+    exportWorkbook = Workbook(write_only = True)
+    RegisterDatabaseStyles(exportWorkbook)
+    dataSheet = exportWorkbook.create_sheet('Database')
+    dataSheet.append(databaseColumns)
+    styles = [DatabaseColumnStyle(j) for j in range(len(databaseColumns))]
+    previousDate = None
+    for row in connection.execute(f"SELECT RegisterDate, {', '.join(databaseColumns)} FROM Surveillance ORDER BY RegisterDate DESC, RowIndex"):
+        if row[0] != previousDate:
+            dataSheet.append([])
+            previousDate = row[0]
+        cells = []
+        for j, (value, style) in enumerate(zip(row[1:], styles)):
+            cell = WriteOnlyCell(dataSheet, value = SheetDate(value) if style == 'Surveillance Date' else value)
+            cell.style = style
+            cells.append(cell)
+        dataSheet.append(cells)
+
+    tempPath = exportPath + '.' + str(getpid()) + '.tmp'
+    exportWorkbook.save(tempPath)
+    replace(tempPath, exportPath)
+
+def LoadSurveillanceHistory(connection, blocks = ()):
+    '''
+    Loads the whole surveillance store, along with blocks of surveillance data that have not been committed
+    yet (given as (updateDate, finalData) pairs, and replacing any stored rows of the same register date),
+    into a frame with typed columns: the register date as a datetime, the company code and currency as
+    categories and the amounts as floats.
+    '''
+    stored = read_sql_query(f"SELECT {', '.join(databaseColumns)} FROM Surveillance", connection)
+    pending = DataFrame([record[3:] for updateDate, finalData in blocks for record in SurveillanceRecords(updateDate, finalData, None)],
+                        columns = databaseColumns)
+    history = concat([stored[~stored['RegisterDate'].isin(pending['RegisterDate'])], pending], ignore_index = True)
+    history['RegisterDate'] = to_datetime(history['RegisterDate'], format = "%Y-%m-%d", errors = 'coerce')
+    history['CompanyCode'] = history['CompanyCode'].astype(str).astype('category')
+    history['Currency'] = history['Currency'].astype(str).astype('category')
+    amounts = databaseColumns[6:15]
+    history[amounts] = history[amounts].apply(to_numeric, errors = 'coerce').astype(float64)
+    return history
+
+def SurveillanceVariances(history):
+    '''
+    Returns the variances of every row of the surveillance history, for each payment type: the register
+    against the proposals, and the treasura report against the register. Amounts are compared by their
+    magnitude, since the proposals, registers and treasura report do not all sign outflows the same way.
+    '''
+    magnitudes = history[databaseColumns[6:15]].abs()
+    variances = DataFrame(index = history.index)
+    for paymentType, proposed, register, treasura in paymentComparisons:
+        variances[f"{paymentType} Register vs Proposals"] = magnitudes[register] - magnitudes[proposed]
+        variances[f"{paymentType} Treasura vs Register"] = magnitudes[treasura] - magnitudes[register]
+    return variances
+
+def SurveillanceBreaks(history, registerDate):
+    '''
+    Flags the breaks of the update for a register date: variances that are at least breakMinimumAmount and
+    more than breakZScore standard deviations away from the mean of the same company's previous breakWindow
+    updates. A company is identified by its company code and currency, which the entity registry keeps
+    unique, so its history survives entities being added to or reordered in the registry. The rolling
+    statistics of every company are computed in one pass rather than once per company.
+    Returns a frame of the breaks with the company code, currency, comparison, variance, its recent mean
+    and its z-score.
+    '''
+    history = history.sort_values('RegisterDate', kind = 'stable').reset_index(drop = True)
+    variances = SurveillanceVariances(history)
+    keys = [history['CompanyCode'], history['Currency']]
+    previous = variances.groupby(keys, observed = True, sort = False).shift()
+    window = previous.groupby(keys, observed = True, sort = False).rolling(breakWindow, min_periods = 10)
+    means = window.mean().droplevel([0, 1]).reindex(history.index)
+    deviations = window.std().droplevel([0, 1]).reindex(history.index)
+    zScores = (variances - means) / deviations.where(deviations > 0)
+
+    current = (history['RegisterDate'] == to_datetime(registerDate, format = "%m/%d/%Y")).to_numpy()
+    flagged = (zScores.abs() > breakZScore).to_numpy() & (variances.abs() >= breakMinimumAmount).to_numpy() & current[:, None]
+    rows, columns = flagged.nonzero()
+    return DataFrame({'CompanyCode': history['CompanyCode'].to_numpy()[rows], 'Currency': history['Currency'].to_numpy()[rows],
+                      'Comparison': variances.columns[columns], 'Variance': variances.to_numpy()[rows, columns],
+                      'Mean': means.to_numpy()[rows, columns], 'ZScore': zScores.to_numpy()[rows, columns]})
+
+def SurveillanceBreaksReport(currentDate, finalData):
+    '''
+    Flags the breaks of a day's block of surveillance data against the history in the surveillance store,
+    and returns them as text for the proposed outflows email.
+    '''
+    try:
+        with TimedStage('SurveillanceBreaks') as stage:
+            connection = OpenSurveillanceStore(seedWorkbook = depositPath)
+            try:
+                history = LoadSurveillanceHistory(connection, [(currentDate, finalData)])
+            finally:
+                connection.close()
+            breaks = SurveillanceBreaks(history, finalData[0, 3])
+            stage['rows'] = len(history)
+            stage['breaks'] = len(breaks)
+    except Exception:
+        print_exc()
+        return '\tThe Surveillance Breaks Could Not Be Computed\n'
+
+    if len(breaks) == 0:
+        return '\tNo Breaks Flagged\n'
+    report = ''
+    for company, currency, comparison, variance, mean, zScore in breaks.itertuples(index = False):
+        report += f"\t{company} {currency} {comparison}: {ToVisualFormat(variance)} (Usually {ToVisualFormat(mean)}, z = {zScore:.1f})\n"
+    return report
+
+def SurveillanceBlock(propCatalog, regCatalog, treasCatalog, currentDate, priorBusinessDay, propRecvDate_DB, onMissing = 'prompt'):
+    '''
+    Finds the proposals, registers and treasura AP EFT report for a day in the directory catalogs and
+    aggregates them into that day's block of the surveillance database.
+    '''
+    propFlaggedFiles_DB = SAPFileDetector(propCatalog, priorBusinessDay, 'Proposal', onMissing) 
+    regFlaggedFiles = SAPFileDetector(regCatalog, priorBusinessDay, 'Register', onMissing) 
+    treasFile = TreasuraFileDetector(treasCatalog, currentDate) 
+    with TimedStage('DataAgreggator_DB', date = currentDate, files = len(propFlaggedFiles_DB) + len(regFlaggedFiles) + 1):
+        return DataAgreggator_DB(CurrentRegistry(), propFlaggedFiles_DB, propCatalog.directory, propRecvDate_DB, regFlaggedFiles, regCatalog.directory, priorBusinessDay, treasFile)
 
+def CommitSurveillanceBlocks(blocks, supplementary = None):
+    '''
+    Commits a run: writes blocks of surveillance data, given as (currentDate, finalData) pairs, to the
+    surveillance store in one transaction, then to the 'Database' sheet together with the supplementary
+    data (a (propFocDate, amount) pair, if given) in one atomic save of the workbook, and only then
+    records their dates as updated. Both writes can be repeated safely, so if the run fails part way
+    through, rerunning the day completes the commit without duplicating anything.
+    Nothing is written if this run no longer holds the program lock.
+    '''
+    CheckProgramLock()
+    with TimedStage('SurveillanceStore', blocks = len(blocks)):
+        connection = OpenSurveillanceStore(seedWorkbook = depositPath)
+        try:
+            AppendSurveillanceRows(connection, blocks, CurrentRegistry().accounts)
+            if databaseExportPath is not None:
+                ExportSurveillanceStore(connection, databaseExportPath)
+        finally:
+            connection.close()
+    if exportDatabaseSheet or supplementary is not None:
+        CheckProgramLock()
+        with TimedStage('CommitDepositWorkbook', blocks = len(blocks)):
+            CommitDepositWorkbook(blocks if exportDatabaseSheet else [], supplementary)
+
+    chmod(dependenciesDir + '$$$$$$$$$$', S_IWUSR | S_IWOTH) 
+    with open(dependenciesDir + '$$$$$$$$$$', 'a') as f:
+        f.write(''.join(currentDate + ';' for currentDate, _ in blocks)) 
+        f.flush()
+        fsync(f.fileno())
+    chmod(dependenciesDir + '$$$$$$$$$$', S_IRUSR | S_IROTH) 
+
+def NotificationRecipients():
+    '''
+    Returns the (name, email address) pairs the proposed outflows email is sent to.
+    '''
     names = []
     emailAdresses = []
     with open(dependenciesDir + '$$$$$$$$$$', 'r') as f: 
@@ -682,12 +2026,71 @@ def ExecuteProposedOutflowsAndDatabaseUpdates(wd, propDir, regDir, treasDir, pro
             name, emailAdress = pair.split(': ')
             names.append(name)
             emailAdresses.append(emailAdress)
+    return list(zip(names, emailAdresses))
+
+def NotificationSender(mailStore = None):
+    '''
+    Returns what the proposed outflows email is sent through: the SMTP server at notificationSmtpServer
+    when it is set, otherwise the mail store.
+    '''
+    if notificationSmtpServer:
+        return SmtpSender(notificationSmtpServer)
+    return mailStore if mailStore is not None else OpenMailStore()
+
+def SendProposedOutflows(sender, recipients, subject, body):
+    '''
+    Sends a proposed outflows email to the recipients and reports any recipients it could not be sent to.
+    '''
+    with TimedStage('DispatchNotification', recipients = len(recipients)) as stage:
+        statuses = DispatchNotification(sender, recipients, subject, body)
+        failures = [(name, email, status) for name, email, status in statuses if status != 'Sent']
+        stage['failed'] = len(failures)
+    print(f"Proposed Daily Outflows Sent To {len(statuses) - len(failures)} of {len(statuses)} Recipients")
+    for name, email, status in failures:
+        print(f"\t{name} <{email}>: {status}")
+
+def CommitSupplementaryData(propFocDate, amount):
+    '''
+    Commits the supplementary data alone, in one atomic save of the workbook at depositPath, for runs whose
+    block of surveillance data could not be built, so that the morning account info spreadsheet still gets
+    the proposed outflows. Nothing is written if this run no longer holds the program lock.
+    '''
+    CheckProgramLock()
+    with TimedStage('CommitDepositWorkbook', blocks = 0):
+        CommitDepositWorkbook([], (propFocDate, amount))
+    print("Supplementary Data Updated Without The Surveillance Database")
+
+def UpdatedDates():
+    '''
+    Returns the dates, as mm/dd/yyyy strings, for which the database has already been updated.
+    '''
+    with open(dependenciesDir + '$$$$$$$$$$', 'r') as f:
+        return set(f.read().split(';'))
+
+def ExecuteProposedOutflowsAndDatabaseUpdates(wd, propDir, regDir, treasDir, propFocDate, currentDate, priorBusinessDay, propRecvDate_DB, mailStore = None, onMissing = 'prompt'):
+
+    propCatalog = CatalogDirectory(propDir) 
+    regCatalog = CatalogDirectory(regDir) 
+    treasCatalog = CatalogDirectory(treasDir) 
+
+    #Daily Outflow Proposals Program Implementation
+    registry = CurrentRegistry()
+    presentDayProposals = SAPFileDetector(propCatalog, propFocDate, 'Proposal', onMissing) 
+    with TimedStage('DataAgreggator_F', date = propFocDate, files = len(presentDayProposals)):
+        messageForEmail, analyzedNames, pooledPropOutflows = DataAgreggator_F(registry, presentDayProposals, propDir, propFocDate) 
+    print("Daily Proposed Outflows Acquired") ; print()
+
+    recipients = NotificationRecipients()
+    sender = NotificationSender(mailStore)
 
-    outlook = win32_Dispatch('outlook.application')
-    for email, name in zip(emailAdresses, names):
-        newEmail = outlook.CreateItem(0) 
-        newEmail.Subject = f"Proposed Daily Outflows for {propFocDate}"
-        newEmail.Body = f'''Hello {name},
+    #Serveillance Database Program Implementation
+    breaksReport = '\tThe Surveillance Database Could Not Be Updated\n'
+    finalData = None
+    try:
+        finalData = SurveillanceBlock(propCatalog, regCatalog, treasCatalog, currentDate, priorBusinessDay, propRecvDate_DB, onMissing)
+        breaksReport = SurveillanceBreaksReport(currentDate, finalData)
+    finally: #the proposed outflows are sent out even if the database cannot be updated
+        body = f'''Hello,
 
     This is an automated message from Ty's SAP S4 v2.0 Payment Proposal Tracker.
 
@@ -698,76 +2101,247 @@ def ExecuteProposedOutflowsAndDatabaseUpdates(wd, propDir, regDir, treasDir, pro
 
     {analyzedNames if len(analyzedNames) > 0 else 'No Proposals Analyzed'}
 
+    Surveillance Breaks for the Registers of {priorBusinessDay}:
+
+    {breaksReport}
 
     Thank You.
     '''
-        newEmail.To = email 
-        newEmail.Send() 
-
+        SendProposedOutflows(sender, recipients, f"Proposed Daily Outflows for {propFocDate}", body)
+        if finalData is None: #the forecast still goes into the supplementary data when the database block cannot be built
+            CommitSupplementaryData(propFocDate, pooledPropOutflows[registry.supplementaryStructure])
 
-    #Serveillance Database Program Implementation
-    propFlaggedFiles_DB = SAPFileDetector(propFilenames, priorBusinessDay, 'Proposal') 
-    regFlaggedFiles = SAPFileDetector(regFilenames, priorBusinessDay, 'Register') 
-    treasFile = TreasuraFileDetector(treasDir, treasFilenames, currentDate) 
-    finalData = DataAgreggator_DB(companyList, currencyList, accountList, propFlaggedFiles_DB, propDir, propRecvDate_DB, regFlaggedFiles, regDir, priorBusinessDay, treasFile)
+    CommitSurveillanceBlocks([(currentDate, finalData)], (propFocDate, pooledPropOutflows[registry.supplementaryStructure]))
 
-    #Update the Database
-    chmod(depositPath, S_IWUSR | S_IWOTH) 
-    DATABASE_WORKBOOK = load_workbook(depositPath)
-    dataSheet = DATABASE_WORKBOOK['Database']
-    dataSheet.insert_rows(idx = 2, amount = 9)
-    for j in range(finalData.shape[1]):
+    print("Surveillance Database Updated Successfully")
 
-        #Built-in formats: https://openpyxl.readthedocs.io/en/stable/_modules/openpyxl/styles/numbers.html
-        cellFormat = 'General'
-        if j < 2:
-            pass
-        elif j < 4 or j == 15:
-            cellFormat = 'mm-dd-yy'
-        elif j < 6:
-            pass
-        else:
-            cellFormat = r'$ #,###.00;[red]$ (#,###.00);$ 0.00;'
+def DryRun(propDir, regDir, treasDir, propFocDate, currentDate, priorBusinessDay, propRecvDate_DB):
+    '''
+    Lists the reports a run for currentDate would analyze from what is already on disk, without reading
+    mail, taking the program lock or writing anything. Returns whether every report was found.
+    '''
+    propCatalog = CatalogDirectory(propDir) 
+    regCatalog = CatalogDirectory(regDir) 
+    treasCatalog = CatalogDirectory(treasDir) 
+    reports = [('Forecast Proposals', SAPFileDetector(propCatalog, propFocDate, 'Proposal', 'continue')),
+               ('Database Proposals', SAPFileDetector(propCatalog, priorBusinessDay, 'Proposal', 'continue')),
+               ('Registers', SAPFileDetector(regCatalog, priorBusinessDay, 'Register', 'continue'))]
+    try:
+        reports.append(('Treasura Report', [path.basename(TreasuraFileDetector(treasCatalog, currentDate))]))
+    except FileNotFoundError:
+        reports.append(('Treasura Report', []))
+    print(f"Dry Run For {currentDate} (Forecast For {propFocDate}, Registers For {priorBusinessDay})")
+    for label, names in reports:
+        print(f"{label}: {', '.join(names) if names else 'None Found'}")
+    return all(names for _, names in reports)
+
+def RunBackfill(startDate, endDate, propDir, regDir, treasDir, mailStore, onMissing = 'skip'):
+    '''
+    Non-interactively catches the surveillance database up for every business day from startDate to endDate
+    (mm/dd/yyyy, inclusive) that has not been updated yet, e.g. after a holiday or an outage.
+    The program lock is held once for the whole range, the reports for every day are downloaded before the
+    directories are catalogued a single time, and the blocks of every day are committed in one database write.
+    Days whose treasura AP EFT report, proposals or registers cannot be found are skipped, so that they are
+    neither committed nor recorded as updated, and are picked up by a later backfill. Only onMissing =
+    'continue' commits such days anyway, with zeros for the missing reports. The proposed outflows email and
+    the supplementary sheet are only concerned with the current day, so they are left to the regular run.
+    '''
+    if onMissing == 'abort': #one missing day must not stop the others from being backfilled
+        onMissing = 'skip'
+    start = datetime.strptime(startDate, "%m/%d/%Y").date()
+    end = datetime.strptime(endDate, "%m/%d/%Y").date()
+    AcquireProgramLock()
+    try:
+        updatedDates = UpdatedDates() #read under the lock, so that days updated by a run this one waited for are not updated again
+        days = [start + timedelta(offset) for offset in range((end - start).days + 1)]
+        days = [day for day in days if day.weekday() < 5 and day <= date.today() and day.strftime("%m/%d/%Y") not in updatedDates]
+        if not days:
+            print(f"The Database Has Already Been Updated For Every Business Day From {startDate} To {endDate}")
+            return
+
+        dayDates = [AcquireDates((date.today() - day).days) for day in days]
+        for propFocDate, currentDate, priorBusinessDay, propRecvDate_DB in dayDates:
+            with TimedStage('AcquireFilesFromOutlook', date = currentDate):
+                AcquireFilesFromOutlook(priorBusinessDay, currentDate, regDir, treasDir, mailStore)
+
+        propCatalog = CatalogDirectory(propDir) 
+        regCatalog = CatalogDirectory(regDir) 
+        treasCatalog = CatalogDirectory(treasDir) 
+        blocks = []
+        for propFocDate, currentDate, priorBusinessDay, propRecvDate_DB in dayDates:
+            print(f"Backfilling {currentDate}")
+            try:
+                blocks.append((currentDate, SurveillanceBlock(propCatalog, regCatalog, treasCatalog, currentDate, priorBusinessDay, propRecvDate_DB, onMissing)))
+            except FileNotFoundError as e:
+                print(f"Skipping {currentDate}: {e}")
 
-        for i in range(finalData.shape[0]):
-            cell = dataSheet.cell(row = i + 3, column = j + 1)
-            cell.value = finalData[i, j]
-            cell.alignment = Alignment(horizontal='center')
-            cell.number_format = cellFormat
+        if blocks:
+            CommitSurveillanceBlocks(blocks)
+            print(f"Surveillance Database Backfilled For {', '.join(currentDate for currentDate, _ in blocks)}")
+    finally:
+        ReleaseProgramLock()
 
-    DATABASE_WORKBOOK.save(depositPath)
-    chmod(depositPath, S_IRUSR | S_IROTH) 
+def WatchProposals(propDir, regDir, treasDir, propFocDate, currentDate, priorBusinessDay, mailStore = None):
+    '''
+    Watches for the proposals of propFocDate as they are sent throughout the day, until watchUntilHour
+    eastern time, when the daily run takes over. Every watchPollSeconds, the new emails are downloaded from
+    the mail store (when one is given, otherwise propDir alone is watched) and only the proposals that are
+    new, or whose size or modification time changed, are parsed. Their pooled outflows are folded into running
+    totals per account structure, and an updated summary is emailed whenever a total has moved by more than
+    watchThreshold since the last summary.
+    Watch mode never writes the database, so it does not hold the program lock, and only downloads the
+    proposals: the registers and treasura report are left to the daily run. Downloading attachments that
+    are already on the drive is skipped by the harvest manifest. A poll that fails is recorded with its
+    error and retried at the next poll, so that the watch goes on for the rest of the day.
+    '''
+    if date.today().weekday() > 4:
+        print('No Proposals Are Sent On A Weekend.')
+        exit(exitCodes['NotReady'])
+
+    registry = CurrentRegistry()
+    structureCount = len(registry.structureNames)
+    dateToken = datetime.strptime(propFocDate, "%m/%d/%Y").strftime("%m%d%y")
+    sender = NotificationSender(mailStore)
+    proposals = {} #filename -> ((size, modified), pooled outflows of the proposal, or None if it could not be analyzed)
+    lastSent = zeros(structureCount, float64)
+
+    print(f"Watching For The Proposals Of {propFocDate} Until {watchUntilHour}:00 Eastern Time")
+    while datetime.now(timezone.utc).astimezone(pytzTZ('Canada/Eastern')).hour < watchUntilHour:
+        try:
+            with TimedStage('WatchProposals', date = propFocDate) as stage:
+                if mailStore is not None:
+                    UpdateInbox(mailStore)
+                    AcquireFilesFromOutlook(priorBusinessDay, currentDate, regDir, treasDir, mailStore, proposalsOnly = True)
+                entries = {entry.name: entry for entry in CatalogDirectory(propDir).byDateToken.get(dateToken, [])}
+                for name in set(proposals) - set(entries):
+                    del proposals[name]
+                changed = [entry for name, entry in entries.items() if name not in proposals or proposals[name][0] != (entry.size, entry.modified)]
+                tasks = [(ScrapeProposal, entry.path, (registry,)) for entry in changed]
+                for entry, (result, error) in zip(changed, IngestFiles(tasks)):
+                    if error is None:
+                        sums, _, _ = result
+                        proposals[entry.name] = ((entry.size, entry.modified), bincount(registry.structures, weights = sums, minlength = structureCount))
+                        print(f"Analyzed {entry.name}")
+                    else: #not retried until the file changes
+                        proposals[entry.name] = ((entry.size, entry.modified), None)
+                        print(f"ERROR analyzing {entry.name}")
+                        print(error)
+                DiscardPipelinedScrapes() #proposals downloaded for another date, or unchanged on the drive, are never analyzed
+                stage['files'] = len(changed)
+
+                pooledPropOutflows = zeros(structureCount, float64)
+                for _, pooled in proposals.values():
+                    if pooled is not None:
+                        pooledPropOutflows += pooled
+                if abs(pooledPropOutflows - lastSent).max() > watchThreshold:
+                    analyzedNames = ''.join('\t' + (name if pooled is not None else 'ERROR analyzing: ' + name) + '\n' for name, (_, pooled) in sorted(proposals.items()))
+                    body = f'''Hello,
+
+    This is an automated intraday update from Ty's SAP S4 v2.0 Payment Proposal Tracker.
+
+
+    Please observe the pooled proposed daily outflows for the day {propFocDate}, from the proposals received as of {datetime.now().strftime("%H:%M")}:
+    {PooledOutflowsMessage(registry, pooledPropOutflows)}
+    Proposals Analyzed:
 
-    chmod(dependenciesDir + '$$$$$$$$$$', S_IWUSR | S_IWOTH) 
-    with open(dependenciesDir + '$$$$$$$$$$', 'a') as f:
-        f.write(currentDate + ';') 
-    chmod(dependenciesDir + '$$$$$$$$$$', S_IRUSR | S_IROTH) 
+    {analyzedNames}
+    These figures will be updated as more proposals are received.
 
-    print("Surveillance Database Updated Successfully")
+    Thank You.
+    '''
+                    SendProposedOutflows(sender, NotificationRecipients(), f"Intraday Proposed Outflows for {propFocDate}", body)
+                    lastSent = pooledPropOutflows
+                    stage['sent'] = True
+        except Exception: #a failed poll, e.g. the mail store, the drive or the recipients file being unavailable, is retried at the next poll
+            print_exc()
+        sleep(watchPollSeconds)
+    print('Watch Mode Finished For The Day')
 
 
 #Program Execution
-EXIT = False
-try:
-    UpdateInbox()
-except Exception: 
-    print_exc() 
-    EXIT = True 
-
-if not EXIT: 
+if __name__ == '__main__': #the reports are parsed in worker processes, which import this file
+    parser = ArgumentParser(description = "SAP S4 payment proposal tracker and surveillance database.")
+    parser.add_argument('--days-prior', type = int, metavar = 'N',
+                        help = "update the database for the day N days ago (0 for today) without the start-up countdown or any prompt")
+    parser.add_argument('--on-missing', choices = ['prompt', 'continue', 'abort', 'skip'],
+                        help = "what to do when no proposals or registers are found for the day (default: prompt, or abort when not interactive, or skip the day when backfilling). Outside a backfill, skip aborts the run")
+    parser.add_argument('--dry-run', action = 'store_true',
+                        help = "list the reports that would be analyzed from what is already on disk, then exit without reading mail or writing anything")
+    parser.add_argument('--backfill', nargs = 2, metavar = ('START', 'END'),
+                        help = "non-interactively update the database for every business day from START to END (mm/dd/yyyy) not yet updated")
+    parser.add_argument('--watch', action = 'store_true',
+                        help = f"watch for the day's proposals until {watchUntilHour}:00 eastern time, emailing the pooled proposed outflows whenever they change by more than {watchThreshold:,.0f}")
+    parser.add_argument('--lock-wait', type = float, metavar = 'SECONDS',
+                        help = f"how long to wait for another run to release the program lock (default: {lockWaitSeconds})")
+    parser.add_argument('--profile', metavar = 'DIR',
+                        help = "profile the run with cProfile and tracemalloc and write the dumps to DIR")
+    arguments = parser.parse_args()
+    interactive = arguments.days_prior is None and arguments.backfill is None and not arguments.watch
+    if arguments.lock_wait is not None:
+        lockWaitSeconds = arguments.lock_wait
+
+    runStarted = datetime.now()
+    runStart = perf_counter()
+    if arguments.profile:
+        from cProfile import Profile
+        import tracemalloc
+        tracemalloc.start()
+        profiler = Profile()
+        profiler.enable()
+
+    wd = getcwd()
+    propDir = dependenciesDir + '$$$$$$$$$$'
+    regDir = dependenciesDir + '$$$$$$$$$$'
+    treasDir = dependenciesDir + '$$$$$$$$$$'
+
+    exitCode = exitCodes['Success']
     try:
-        wd = getcwd()
-        propDir = dependenciesDir + '$$$$$$$$$$'
-        regDir = dependenciesDir + '$$$$$$$$$$'
-        treasDir = dependenciesDir + '$$$$$$$$$$'
-        propFocDate, currentDate, priorBusinessDay, propRecvDate_DB = InitializeApplication() 
-        AcquireProgramLock() 
-        AcquireFilesFromOutlook(priorBusinessDay, currentDate, regDir, treasDir) 
-        ExecuteProposedOutflowsAndDatabaseUpdates(wd, propDir, regDir, treasDir, propFocDate, currentDate, priorBusinessDay, propRecvDate_DB) 
-        PropRegTreasFolderCleanup(currentDate, propDir, regDir, treasDir) 
-    except SystemExit:
+        if arguments.dry_run:
+            if not DryRun(propDir, regDir, treasDir, *AcquireDates(arguments.days_prior or 0)):
+                exitCode = exitCodes['NotReady']
+        else:
+            mailStore = OpenMailStore()
+            with TimedStage('UpdateInbox'):
+                UpdateInbox(mailStore)
+            if arguments.watch:
+                propFocDate, currentDate, priorBusinessDay, _ = AcquireDates()
+                WatchProposals(propDir, regDir, treasDir, propFocDate, currentDate, priorBusinessDay, mailStore)
+            elif arguments.backfill:
+                RunBackfill(*arguments.backfill, propDir, regDir, treasDir, mailStore, arguments.on_missing or 'skip')
+            else:
+                propFocDate, currentDate, priorBusinessDay, propRecvDate_DB = InitializeApplication(arguments.days_prior) 
+                AcquireProgramLock() 
+                if currentDate in UpdatedDates(): #another run may have updated the day while this one waited for the lock
+                    print("The Database Has Already Been Updated For", currentDate)
+                    exit(exitCodes['AlreadyUpdated'])
+                with TimedStage('AcquireFilesFromOutlook', date = currentDate):
+                    AcquireFilesFromOutlook(priorBusinessDay, currentDate, regDir, treasDir, mailStore) 
+                onMissing = arguments.on_missing or ('prompt' if interactive else 'abort')
+                if onMissing == 'skip': #skipping the only day of the run is aborting it, which exits as not ready rather than failed
+                    onMissing = 'abort'
+                ExecuteProposedOutflowsAndDatabaseUpdates(wd, propDir, regDir, treasDir, propFocDate, currentDate, priorBusinessDay, propRecvDate_DB, mailStore, onMissing) 
+                with TimedStage('PropRegTreasFolderCleanup'):
+                    PropRegTreasFolderCleanup(currentDate, propDir, regDir, treasDir) 
+    except SystemExit as e:
         print('Program Terminated')
+        exitCode = e.code if isinstance(e.code, int) else exitCodes['Failure']
     except Exception:
         print_exc()
+        exitCode = exitCodes['Failure']
     finally:
         ReleaseProgramLock()
+
+    record = {'started': runStarted.isoformat(timespec = 'seconds'), 'arguments': vars(arguments), 'exitCode': exitCode,
+              'seconds': round(perf_counter() - runStart, 4), 'stages': runRecord['stages'], 'parses': runRecord['parses']}
+    if arguments.profile:
+        profiler.disable()
+        stamp = runStarted.strftime("%Y%m%d_%H%M%S")
+        profiler.dump_stats(path.join(arguments.profile, f"SAPS4Tracker_{stamp}.prof"))
+        record['peakTracedBytes'] = tracemalloc.get_traced_memory()[1]
+        with open(path.join(arguments.profile, f"SAPS4Tracker_{stamp}_memory.txt"), 'w') as f:
+            for statistic in tracemalloc.take_snapshot().statistics('lineno')[:50]:
+                f.write(str(statistic) + '\n')
+        tracemalloc.stop()
+    if not arguments.dry_run:
+        SaveRunRecord(record)
+    exit(exitCode)